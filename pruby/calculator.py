@@ -49,6 +49,31 @@ class PressureCalculator:
         self.engine.backfit()
         self.engine.peakfit()
 
+    def read_series(self, path: str = '', warm_start: bool = False):
+        """
+        Read consecutive frames of a multi-frame spectrum file one by one.
+        After reading every frame, fit its background and peaks, calculate
+        pressure and yield the calculator with updated `r1`, `p` etc.
+
+        :param path: Path to the file; if not given, use current `dat_path`.
+        :param warm_start: If True, seed background fit of every frame
+            with the result for previous one, if the backfitter supports it.
+        """
+        self.dat_path = path if path else self.dat_path
+        backfitter = self.engine.backfitter
+        backfitter.reset()
+        backupped_warm_start = backfitter.warm_start
+        backfitter.warm_start = warm_start or backupped_warm_start
+        try:
+            for frame in self.engine.read_frames():
+                self.raw_spectrum = frame
+                self.engine.backfit()
+                self.engine.peakfit()
+                self.calculate_p_from_r1()
+                yield self
+        finally:
+            backfitter.warm_start = backupped_warm_start
+
     def calculate_p_from_r1(self):
         self.engine.correct()
         self.engine.translate()
@@ -55,8 +55,12 @@ class Engine:
     def read(self):
         self.reader.read(self.calc)
 
+    def read_frames(self):
+        return self.reader.frames(self.calc)
+
     def backfit(self):
-        self.backfitter.backfit(self.calc)
+        if not self.peakfitter.fits_background:
+            self.backfitter.backfit(self.calc)
 
     def peakfit(self):
         self.peakfitter.peakfit(self.calc)
@@ -1,2 +1,3 @@
 from .curve import Curve
-from .spectrum import Spectrum
+from .spectrum import Spectrum, SpectrumView
+from .stack import SpectrumStack
@@ -3,18 +3,71 @@ import numpy as np
 
 
 class Curve:
-    def __init__(self, func: Callable = lambda x: 0, args=tuple()):
+    """
+    Function `func(x, *args)` with default `args`. If `vectorized`,
+    `func` is assumed to broadcast over numpy arrays and is evaluated
+    on whole array of x at once; otherwise it is called for every x value.
+    Optional `jac(x, *args)` should return an analytic jacobian of `func`
+    with respect to `args` as an array of shape (len(x), len(args)).
+    """
+    __slots__ = ('_func', '_args', '_version', 'uncs', 'vectorized', 'jac')
+
+    def __init__(self, func: Callable = lambda x: 0, args=tuple(),
+                 vectorized: bool = False, jac: Callable = None):
+        self._version: int = 0
         self.func: Callable = func
         self.args: Iterable = args
         self.uncs: tuple = tuple(np.zeros_like(args))
+        self.vectorized: bool = vectorized
+        self.jac: Callable = jac
+
+    @property
+    def func(self) -> Callable:
+        return self._func
+
+    @func.setter
+    def func(self, value: Callable):
+        self._func = value
+        self._version += 1
+
+    @property
+    def args(self) -> tuple:
+        return self._args
+
+    @args.setter
+    def args(self, value: Iterable):
+        self._args = tuple(value)
+        self._version += 1
+
+    @property
+    def version(self) -> int:
+        """Counter incremented every time `func` or `args` are changed;
+        `args` are stored as a tuple, so that they can not change in-place"""
+        return self._version
+
+    def copy(self):
+        """Return a new curve sharing `func` with self, with copied `args`"""
+        new = Curve(func=self.func, args=tuple(self.args),
+                    vectorized=self.vectorized, jac=self.jac)
+        new.uncs = self.uncs
+        return new
 
     def __call__(self, *args):
         x, args = self._interpret_call(args)
+        if self.vectorized:
+            return self.func(x, *args)
         try:
             return np.array([self.func(x_val, *args) for x_val in x])
         except TypeError:
             return self.func(x, *args)
 
+    def jacobian(self, *args):
+        """Evaluate `jac` at x with arguments used as in `__call__`"""
+        if self.jac is None:
+            raise AttributeError('Curve has no analytic jacobian')
+        x, args = self._interpret_call(args)
+        return np.asarray(self.jac(x, *args))
+
     def _interpret_call(self, args):
         call_x, call_args = args[0], args[1:]
         args = list(self.args)
@@ -2,18 +2,40 @@ import enum
 import numpy as np
 
 from .curve import Curve
+from ..utility import kernels
 from ..utility.line_subset import LineSubset
+from ..utility.models import Model
 
 
 class Spectrum:
+    """
+    Spectrum of points `x`, `y` with a model `curve`, fitting `focus`
+    and `sigma_type`. If `dtype` or class-level `storage_dtype` are given,
+    x and y are stored using them, e.g. `np.float32` to save memory;
+    derived values such as `f` or `delta` are always evaluated in float64.
+    Input x and y are copied, unless `copy` is False, in which case they
+    may share memory with the input, e.g. a memory-mapped file, and must
+    not be modified in-place by the caller afterwards. Stored x and y are
+    read-only and can be changed only by assigning new arrays to them.
+    """
+    __slots__ = ('_x', '_y', '_curve', '_focus', '_sigma_type', '_dtype',
+                 '_cache', '_curve_cache', '_curve_version', '_data_cache')
+    storage_dtype = None
+
     class SigmaType(enum.Enum):
         equal = 'equal'
         huber = 'huber'
 
     def __init__(self, x=tuple(), y=tuple(), curve=Curve(),
-                 focus=LineSubset(), sigma_type='equal'):
-        self.x = np.array(x)
-        self.y = np.array(y)
+                 focus=LineSubset(), sigma_type='equal', dtype=None,
+                 copy=True):
+        self._dtype = self.storage_dtype if dtype is None else dtype
+        self._cache = {}
+        self._curve_cache = {}
+        self._data_cache = {}
+        self._curve_version = None
+        self._x = self._as_data(x, copy=copy)
+        self._y = self._as_data(y, copy=copy)
         self.curve = curve
         self.focus = self.domain if focus == LineSubset() else focus
         self.sigma_type = sigma_type
@@ -24,6 +46,103 @@ class Spectrum:
     def __bool__(self):
         return len(self.x) > 0
 
+    def copy(self, **changes):
+        """
+        Return a cheap copy of self, which shares read-only x and y with self,
+        shares focus and holds a shallow copy of the curve. Since x and y can
+        be only replaced and not modified in-place, the copy is unaffected
+        by any later changes of self and vice versa. Any of `x`, `y`, `curve`,
+        `focus` or `sigma_type` can be replaced in the copy by passing them
+        as keyword arguments.
+        """
+        attributes = {'x': self.x,
+                      'y': self.y,
+                      'curve': self.curve.copy(),
+                      'focus': self.focus,
+                      'sigma_type': self.sigma_type.value,
+                      'dtype': self._dtype}
+        for name in ('x', 'y'):
+            if name in changes:
+                changes[name] = np.array(changes[name])
+        attributes.update(changes)
+        return Spectrum(copy=False, **attributes)
+
+    def _as_data(self, value, copy=True):
+        """Return `value` as a read-only array of `dtype`, copied if `copy`"""
+        array = np.array(value, dtype=self._dtype) if copy \
+            else np.asarray(value, dtype=self._dtype).view()
+        array.flags.writeable = False
+        return array
+
+    @staticmethod
+    def _as_float64(array):
+        is_short_float = array.dtype.kind == 'f' and array.dtype.itemsize < 8
+        return array.astype(np.float64) if is_short_float else array
+
+    # CACHING METHODS
+    def _clear_cache(self):
+        self._cache.clear()
+        self._curve_cache.clear()
+
+    def _cached_on_curve(self, name, compute):
+        """Return value `name` computed with current curve, computing it
+        using `compute` only if the curve or its arguments have changed"""
+        if self._curve_version != self.curve.version:
+            self._curve_cache.clear()
+            self._curve_version = self.curve.version
+        if name not in self._curve_cache:
+            value = compute()
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            self._curve_cache[name] = value
+        return self._curve_cache[name]
+
+    def cached_on_data(self, name, compute):
+        """Return value `name` which depends on x and y only, computing
+        it using `compute` only if x or y have been replaced since"""
+        if name not in self._data_cache:
+            self._data_cache[name] = compute()
+        return self._data_cache[name]
+
+    # DATA PROPERTIES
+    @property
+    def x(self):
+        return self._x
+
+    @x.setter
+    def x(self, value):
+        self._x = self._as_data(value)
+        self._data_cache.clear()
+        self._clear_cache()
+
+    @property
+    def y(self):
+        return self._y
+
+    @y.setter
+    def y(self, value):
+        self._y = self._as_data(value)
+        self._data_cache.clear()
+        self._clear_cache()
+
+    @property
+    def curve(self):
+        return self._curve
+
+    @curve.setter
+    def curve(self, value):
+        self._curve = value
+        self._clear_cache()
+
+    @property
+    def focus(self):
+        return self._focus
+
+    @focus.setter
+    def focus(self, value):
+        self._focus = value
+        self._clear_cache()
+
     @property
     def sigma_type(self):
         return self._sigma_type
@@ -31,29 +150,46 @@ class Spectrum:
     @sigma_type.setter
     def sigma_type(self, value):
         self._sigma_type = self.SigmaType(value)
+        self._clear_cache()
 
+    # DERIVED PROPERTIES
     @property
     def f(self):
-        return np.array(list(map(self.curve, self.x)))
+        return self._cached_on_curve('f', self._calculate_f)
+
+    def _calculate_f(self):
+        x = self._as_float64(self.x)
+        return np.array(np.broadcast_to(self.curve(x), x.shape))
 
     @property
     def delta(self):
+        return self._cached_on_curve('delta', self._calculate_delta)
+
+    def _calculate_delta(self):
+        if self.curve.vectorized and isinstance(self.curve.func, Model) \
+                and 'f' not in self._curve_cache:
+            x = self._as_float64(self.x)
+            return self.curve.func.residual(x, self.y, *self.curve.args,
+                                            out=np.empty(x.shape))
         return self.y - self.f
 
     @property
     def si(self):
+        return self._cached_on_curve('si', self._calculate_si)
+
+    def _calculate_si(self):
         if self.sigma_type == self.SigmaType.equal:
-            return np.ones_like(self.x)
+            return np.ones(self.x.shape)
         elif self.sigma_type == self.SigmaType.huber:
-            tol = 0.01 * max(abs(self.delta))
-            return np.array([tol ** 2 if d < tol else
-                             tol * (2 * d - tol) for d in self.delta])
+            return kernels.backend.huber_sigma(self.delta,
+                                               np.empty(self.x.shape))
         else:
             raise KeyError('Unknown sigma type "{}"'.format(self.sigma_type))
 
     @property
     def mse(self):
-        return sum((self.delta / self.si) ** 2) / len(self.delta)
+        return self._cached_on_curve('mse', lambda: sum(
+            (self.delta / self.si) ** 2) / len(self.delta))
 
     @property
     def domain(self):
@@ -64,12 +200,15 @@ class Spectrum:
 
     @property
     def focused(self):
-        return self.within(self.focus)
+        if 'focused' not in self._cache:
+            self._cache['focused'] = SpectrumView(self, self.focus)
+        return self._cache['focused']
 
     def within(self, subset):
-        in_subset = [True if x in subset else False for x in self.x]
+        in_subset = subset.mask(self.x)
         return Spectrum(self.x[in_subset], self.y[in_subset], curve=self.curve,
-                        focus=subset, sigma_type=self.sigma_type.value)
+                        focus=subset, sigma_type=self.sigma_type.value,
+                        dtype=self._dtype, copy=False)
 
     def focus_on_edge(self, width=1.0):
         sub1 = LineSubset(min(self.x), min(self.x) + width)
@@ -82,3 +221,32 @@ class Spectrum:
     def focus_on_points(self, points, width=1.0):
         points_area = LineSubset([(p - width/2, p + width/2) for p in points])
         self.focus = points_area * self.domain
+
+
+class SpectrumView(Spectrum):
+    """
+    Read-only `Spectrum` of `parent`'s points within `subset`, which shares
+    data buffers with `parent`. Points are selected using a slice if they
+    are contiguous, for example if subset is a single segment and x is sorted,
+    or using an index array otherwise. The view should be discarded
+    once the x, y, curve, focus or sigma type of parent change.
+    """
+    __slots__ = ('parent', 'index')
+
+    def __init__(self, parent: Spectrum, subset: LineSubset):
+        self.parent = parent
+        self.index = self._locate(parent.x, subset)
+        super().__init__(x=parent.x[self.index], y=parent.y[self.index],
+                         curve=parent.curve, focus=subset,
+                         sigma_type=parent.sigma_type.value,
+                         dtype=parent._dtype, copy=False)
+
+    @staticmethod
+    def _locate(x, subset):
+        indices = np.flatnonzero(subset.mask(x))
+        if len(indices) == 0:
+            return slice(0, 0)
+        elif indices[-1] - indices[0] + 1 == len(indices):
+            return slice(indices[0], indices[-1] + 1)
+        else:
+            return indices
@@ -0,0 +1,148 @@
+import glob
+import os
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from natsort import natsorted
+
+from .spectrum import Spectrum
+from ..utility.fitting import irls_polynomial_fit
+from ..utility.line_subset import LineSubset
+
+
+class SpectrumStack:
+    """
+    Container for many spectra sharing a common x grid, which stores their
+    intensities as a single 2-D `y` array of shape (len(stack), len(x)).
+    """
+
+    def __init__(self, x=tuple(), y=None, focus=LineSubset()):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.empty((0, len(self.x))) if y is None \
+            else np.atleast_2d(np.asarray(y, dtype=float))
+        if self.y.shape[1] != len(self.x):
+            raise ValueError(f'Shape of y {self.y.shape} does not match '
+                             f'length of x ({len(self.x)})')
+        self.focus = self.domain if focus == LineSubset() else focus
+
+    def __len__(self):
+        return self.y.shape[0]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, index):
+        return Spectrum(self.x, self.y[index], focus=self.focus)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    # CREATION METHODS
+    @classmethod
+    def from_spectra(cls, spectra, resample='exact', x=None):
+        """
+        Create a stack from an iterable of `Spectrum` objects.
+
+        :param spectra: Spectra to be stacked.
+        :param resample: If 'exact', require all spectra to share the same x;
+            if 'interpolate', linearly interpolate all spectra onto `x`.
+        :param x: Common x grid used when interpolating. By default, use x
+            of the first spectrum within the range covered by all spectra.
+        """
+        spectra = list(spectra)
+        if not spectra:
+            return cls()
+        if resample == 'exact':
+            x = spectra[0].x
+            for spectrum in spectra[1:]:
+                if not np.array_equal(spectrum.x, x):
+                    raise ValueError('Spectra do not share common x grid; '
+                                     'use resample="interpolate" instead')
+            return cls(x, np.vstack([s.y for s in spectra]))
+        elif resample == 'interpolate':
+            if x is None:
+                left = max(min(s.x) for s in spectra)
+                right = min(max(s.x) for s in spectra)
+                x = spectra[0].x[LineSubset(left, right).mask(spectra[0].x)]
+            y = np.empty((len(spectra), len(x)))
+            for i, s in enumerate(spectra):
+                order = np.argsort(s.x)
+                y[i] = np.interp(x, s.x[order], s.y[order])
+            return cls(x, y)
+        else:
+            raise KeyError(f'Unknown resample mode "{resample}"')
+
+    @classmethod
+    def read(cls, paths, reading='', limits=LineSubset(690.0, 705.0),
+             resample='exact', workers=None):
+        """
+        Read many spectra in a thread pool using a registered reading strategy.
+
+        :param paths: Directory, glob pattern, or an iterable of file paths.
+        :param reading: Name of strategy registered in `ReadingStrategies`;
+            if not given, use the default one.
+        :param limits: `LineSubset` to which the spectra will be cropped.
+        :param resample: Passed to `from_spectra`: 'exact' or 'interpolate'.
+        :param workers: Maximum number of threads used to read the files.
+        """
+        from pruby.strategies import ReadingStrategies
+        if isinstance(paths, str) and os.path.isdir(paths):
+            paths = [os.path.join(paths, f) for f in os.listdir(paths)]
+            paths = natsorted(p for p in paths if os.path.isfile(p))
+        elif isinstance(paths, str):
+            paths = natsorted(glob.glob(paths))
+
+        def read_one(path):
+            calc = types.SimpleNamespace(dat_path=path, limits=limits,
+                                         raw_spectrum=Spectrum())
+            ReadingStrategies.create(name=reading).read(calc)
+            return calc.raw_spectrum
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            spectra = list(executor.map(read_one, paths))
+        return cls.from_spectra(spectra, resample=resample)
+
+    # PROPERTIES
+    @property
+    def domain(self):
+        if len(self.x) == 0:
+            return LineSubset()
+        else:
+            return LineSubset(min(self.x), max(self.x))
+
+    @property
+    def focused(self):
+        return self.within(self.focus)
+
+    # VECTORIZED OPERATIONS
+    def within(self, subset):
+        in_subset = np.flatnonzero(subset.mask(self.x))
+        if len(in_subset) and in_subset[-1] - in_subset[0] + 1 == \
+                len(in_subset):
+            in_subset = slice(in_subset[0], in_subset[-1] + 1)
+        return SpectrumStack(self.x[in_subset], self.y[:, in_subset],
+                             focus=subset)
+
+    def subtract(self, background):
+        """Return stack with `background` array broadcastable to y removed"""
+        return SpectrumStack(self.x, self.y - background, focus=self.focus)
+
+    def polynomial(self, coefficients):
+        """Evaluate one polynomial per spectrum, given as a row of increasing
+        order `coefficients`, on x; return array of the same shape as y"""
+        coefficients = np.atleast_2d(coefficients)
+        vandermonde = np.vander(self.x, coefficients.shape[1], increasing=True)
+        return coefficients @ vandermonde.T
+
+    def fit_polynomial(self, degree=1, sigma_type='huber', coefficients=None):
+        """Fit one polynomial background per spectrum to points in focus
+        by iteratively reweighted least squares; return its coefficients"""
+        return irls_polynomial_fit(self.x, self.y, degree=degree,
+                                   sigma_type=sigma_type,
+                                   mask=self.focus.mask(self.x),
+                                   coefficients=coefficients)
+
+    def subtract_polynomial(self, coefficients):
+        """Return stack with one polynomial background per spectrum removed"""
+        return self.subtract(self.polynomial(coefficients))
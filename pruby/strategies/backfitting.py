@@ -1,17 +1,24 @@
 import abc
-import copy
 from collections import OrderedDict
-from scipy.optimize import curve_fit
+import numpy as np
 from pruby.strategies import BaseStrategy, BaseStrategies
-from pruby.utility import polynomial
+from pruby.utility import PolynomialModel
+from pruby.utility.fitting import irls_polynomial_fit, arpls_baseline, \
+    chord_coefficients
 from pruby.spectrum import Curve
 
 
 class BackfittingStrategy(BaseStrategy, abc.ABC):
+    warm_start = False
+
     @abc.abstractmethod
     def backfit(self, calc):
         raise NotImplementedError
 
+    def reset(self):
+        """Forget any state carried between consecutive backfits"""
+        pass
+
 
 class BackfittingStrategies(BaseStrategies):
     registry = OrderedDict()
@@ -20,34 +27,59 @@ class BackfittingStrategies(BaseStrategies):
 
 class BaseBackfittingStrategy(BackfittingStrategy, abc.ABC):
     reference = r'https://doi.org/10.1016/j.chemolab.2004.10.003'
-
-    @staticmethod
-    def _approximate_linearly(spectrum):
-        def linear_function(x, _a0, _a1):
-            return polynomial(_a0, _a1)(x)
-        a1 = (spectrum.y[-1] - spectrum.y[0]) / (spectrum.x[-1] - spectrum.x[0])
-        a0 = spectrum.y[0] - a1 * spectrum.x[0]
-        spectrum.curve = Curve(func=linear_function, args=(a0, a1))
+    degree = 1
+    shift_tolerance = 1e-6
+
+    def __init__(self, warm_start=False):
+        """
+        :param warm_start: If True, seed every fit with the background
+            converged for the previous spectrum, unless its domain differs
+            or it describes the new spectrum worse than a cold start would.
+            Since the seed is already close to the result, fits then iterate
+            until the background shifts by less than `shift_tolerance`
+            of the spectrum's range instead of stopping at the first cycle
+            which does not improve the mean squared error.
+        """
+        self.model = PolynomialModel(degree=self.degree)
+        self.warm_start = warm_start
+        self._previous = None
+
+    def reset(self):
+        self._previous = None
+
+    def _approximate_linearly(self, spectrum):
+        args = chord_coefficients(spectrum.x, spectrum.y, self.degree)
+        spectrum.curve = Curve(func=self.model, args=tuple(args),
+                               vectorized=True, jac=self.model.jacobian)
 
     @abc.abstractmethod
     def _prepare_backfit(self, calc):
         pass
 
+    def _seed_from_previous(self, spectrum):
+        """Replace cold-start curve args with previous ones if they fit better"""
+        if self._previous is None or self._previous[0] != spectrum.domain:
+            return
+        cold_args, cold_mse = spectrum.curve.args, spectrum.mse
+        spectrum.curve.args = self._previous[1]
+        if not spectrum.mse <= cold_mse:
+            spectrum.curve.args = cold_args
+
     def backfit(self, calc):
         self._prepare_backfit(calc)
-        for cycle in range(50):
-            previous_mse = calc.back_spectrum.mse
-            x = calc.back_spectrum.focused.x
-            y = calc.back_spectrum.focused.y
-            si = calc.back_spectrum.focused.si
-            calc.back_spectrum.curve.args, _ = \
-                curve_fit(calc.back_spectrum.curve, xdata=x, ydata=y,
-                          p0=calc.back_spectrum.curve.args, sigma=si)
-            if previous_mse / calc.back_spectrum.mse - 1 < 1e-10:
-                break
+        spectrum = calc.back_spectrum
+        if self.warm_start:
+            self._seed_from_previous(spectrum)
+        spectrum.curve.args = tuple(irls_polynomial_fit(
+            spectrum.x, spectrum.y, degree=self.degree,
+            sigma_type=spectrum.sigma_type.value,
+            mask=spectrum.focus.mask(spectrum.x),
+            coefficients=spectrum.curve.args, max_cycles=50, tolerance=1e-10,
+            shift_tolerance=self.shift_tolerance if self.warm_start else None))
+        self._previous = (spectrum.domain, spectrum.curve.args)
         calc.back_spectrum.y = calc.back_spectrum.f
-        calc.peak_spectrum = copy.deepcopy(calc.raw_spectrum)
-        calc.peak_spectrum.y = calc.raw_spectrum.y - calc.back_spectrum.y
+        calc.peak_spectrum = calc.raw_spectrum.copy(
+            y=calc.raw_spectrum.y - calc.back_spectrum.y)
 
 
 @BackfittingStrategies.register(default=True)
@@ -55,7 +87,7 @@ class HuberBackfittingStrategy(BaseBackfittingStrategy):
     name = 'Linear Huber'
 
     def _prepare_backfit(self, calc):
-        calc.back_spectrum = copy.deepcopy(calc.raw_spectrum)
+        calc.back_spectrum = calc.raw_spectrum.copy()
         self._approximate_linearly(calc.back_spectrum)
         calc.back_spectrum.focus_on_whole()
         calc.back_spectrum.sigma_type = 'huber'
@@ -66,16 +98,46 @@ class SateliteBackfittingStrategy(BaseBackfittingStrategy):
     name = 'Linear Satelite'
 
     def _prepare_backfit(self, calc):
-        calc.back_spectrum = copy.deepcopy(calc.raw_spectrum)
+        calc.back_spectrum = calc.raw_spectrum.copy()
         self._approximate_linearly(calc.back_spectrum)
         calc.back_spectrum.focus_on_edge(width=1.0)
         calc.back_spectrum.sigma_type = 'equal'
 
 
+@BackfittingStrategies.register()
+class ArplsBackfittingStrategy(BackfittingStrategy):
+    name = 'arPLS'
+    year = 2015
+    reference = r'https://doi.org/10.1039/C4AN01061B'
+
+    def __init__(self, smoothness=1e6, tolerance=1e-3, max_cycles=50):
+        self.smoothness = smoothness
+        self.tolerance = tolerance
+        self.max_cycles = max_cycles
+
+    def backfit(self, calc):
+        calc.back_spectrum = calc.raw_spectrum.copy()
+        calc.back_spectrum.focus_on_whole()
+        order = np.argsort(calc.back_spectrum.x)
+        x = calc.back_spectrum.x[order]
+        baseline = arpls_baseline(calc.back_spectrum.y[order],
+                                  smoothness=self.smoothness,
+                                  tolerance=self.tolerance,
+                                  max_cycles=self.max_cycles)
+
+        def interpolated_baseline(x_new):
+            return np.interp(x_new, x, baseline)
+        calc.back_spectrum.curve = Curve(func=interpolated_baseline,
+                                         vectorized=True)
+        calc.back_spectrum.y = calc.back_spectrum.f
+        calc.peak_spectrum = calc.raw_spectrum.copy(
+            y=calc.raw_spectrum.y - calc.back_spectrum.y)
+
+
 @BackfittingStrategies.register()
 class NullBackfittingStrategy(BackfittingStrategy):
     name = 'No background fitting'
 
     def backfit(self, calc):
-        calc.back_spectrum = copy.deepcopy(calc.raw_spectrum)
-        calc.back_spectrum.y = calc.back_spectrum.y * 0.0
+        calc.back_spectrum = calc.raw_spectrum.copy(
+            y=calc.raw_spectrum.y * 0.0)
@@ -1,7 +1,7 @@
 import abc
 from collections import OrderedDict
 from pruby.strategies.base import BaseStrategy, BaseStrategies
-from pruby.utility import polynomial
+from pruby.utility import Polynomial
 from pruby.constants import T_0, UZERO
 
 
@@ -10,20 +10,26 @@ def to_wavelength(wavenumber):
     return 1e7 / wavenumber
 
 
+RAGAN_R1_WAVENUMBER = Polynomial(14423, 4.49e-2, -4.81e-4, 3.71e-7)
+RAGAN_R2_WAVENUMBER = Polynomial(14452, 3.00e-2, -3.88e-4, 2.55e-7)
+VOS_R1_SHIFT = Polynomial(0.0, 6.591e-3, 7.624e-6, -1.733e-8)
+VOS_R2_SHIFT = Polynomial(0.0, 6.554e-3, 8.670e-6, -1.099e-8)
+
+
 def ragan_r1_position(t):
-    return to_wavelength(polynomial(14423, 4.49e-2, -4.81e-4, 3.71e-7)(t))
+    return to_wavelength(RAGAN_R1_WAVENUMBER(t))
 
 
 def ragan_r2_position(t):
-    return to_wavelength(polynomial(14452, 3.00e-2, -3.88e-4, 2.55e-7)(t))
+    return to_wavelength(RAGAN_R2_WAVENUMBER(t))
 
 
 def vos_r1_shift(t):
-    return 0.1 * polynomial(0.0, 6.591e-2, 7.624e-5, -1.733e-7)(t - 300.0)
+    return VOS_R1_SHIFT(t - 300.0)
 
 
 def vos_r2_shift(t):
-    return 0.1 * polynomial(0.0, 6.554e-2, 8.670e-5, -1.099e-7)(t - 300.0)
+    return VOS_R2_SHIFT(t - 300.0)
 
 
 class CorrectingStrategy(BaseStrategy, abc.ABC):
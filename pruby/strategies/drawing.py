@@ -77,7 +77,7 @@ class BaseDrawingStrategy(DrawingStrategy, abc.ABC):
         ls = '--' if bg else '-'
         self.ax.plot(spectrum.x, y, self.color, ls=ls)
         self.ax.fill_between(x=spectrum.x, y1=y, color=self.color, alpha=0.2,
-                             where=[_ in spectrum.focus for _ in spectrum.x])
+                             where=spectrum.focus.mask(spectrum.x))
 
     def draw_vline(self, x):
         self.ax.axvline(x, color=self.color)
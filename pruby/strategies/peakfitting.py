@@ -2,15 +2,21 @@ import abc
 from collections import OrderedDict
 import numpy as np
 from scipy.optimize import curve_fit as scipy_fit
-from scipy.signal import find_peaks_cwt
+from scipy.ndimage import uniform_filter1d
+from scipy.signal import find_peaks, find_peaks_cwt
 from uncertainties import ufloat
 from pruby.strategies.base import BaseStrategy, BaseStrategies
-from pruby.utility import gaussian, pseudovoigt
+from pruby.utility import Model, GaussianModel, PseudovoigtModel, \
+    CamelModel, PolynomialModel
+from pruby.utility.fitting import scaled_curve_fit, batched_curve_fit, \
+    chord_coefficients
 from pruby.spectrum import Curve
 from pruby.constants import R1_0, R2_0
 
 
 class PeakfittingStrategy(BaseStrategy, abc.ABC):
+    fits_background = False
+
     @abc.abstractmethod
     def peakfit(self, calc):
         raise NotImplementedError
@@ -22,55 +28,133 @@ class PeakfittingStrategies(BaseStrategies):
 
 
 class BasePeakfittingStrategy(PeakfittingStrategy):
+    focus_width = 1.0
+    position_indices = (1, 4)
+
+    def __init__(self, peak_finder='fast'):
+        """
+        :param peak_finder: Method used to find initial positions of peaks:
+            'fast' to look for maxima of smoothed spectrum (default) or 'cwt'
+            to use continuous wavelet transform, e.g. for pathological data.
+        """
+        self.model = self._create_model()
+        self.peak_finder = peak_finder
+
+    @staticmethod
     @abc.abstractmethod
-    def _prepare_peakfit(self, calc):
+    def _create_model() -> Model:
         pass
 
+    def _create_curve(self, args):
+        return Curve(func=self.model, args=args, vectorized=True,
+                     jac=self.model.jacobian)
+
     @abc.abstractmethod
-    def _assign_peaks(self, calc):
+    def _initial_args(self, r1x, r1y, r2x, r2y) -> tuple:
         pass
 
+    def _prepare_peakfit(self, calc):
+        peaks = self.find_initial_peaks(calc.peak_spectrum)
+        calc.peak_spectrum.curve = \
+            self._create_curve(args=self._initial_args(*peaks))
+        calc.peak_spectrum.focus_on_points((peaks[0], peaks[2]),
+                                           width=self.focus_width)
+        calc.peak_spectrum.sigma_type = 'equal'
+
+    def _assign_peaks(self, calc):
+        curve = calc.peak_spectrum.curve
+        calc.r1 = self.ufloat_from_curve_args(curve, self.position_indices[0])
+        calc.r2 = self.ufloat_from_curve_args(curve, self.position_indices[1])
+
     def peakfit(self, calc):
         self._prepare_peakfit(calc)
         x = calc.peak_spectrum.focused.x
         y = calc.peak_spectrum.focused.y
         si = calc.peak_spectrum.focused.si
-        calc.peak_spectrum.curve.args, pcov = \
-            scipy_fit(calc.peak_spectrum.curve, xdata=x, ydata=y,
-                      p0=calc.peak_spectrum.curve.args, sigma=si)
+        curve = calc.peak_spectrum.curve
+        if isinstance(curve.func, Model):
+            calc.peak_spectrum.curve.args, pcov = \
+                scaled_curve_fit(curve.func, x, y, p0=curve.args, sigma=si)
+        else:
+            calc.peak_spectrum.curve.args, pcov = \
+                scipy_fit(curve, xdata=x, ydata=y, p0=curve.args, sigma=si,
+                          jac=curve.jacobian if curve.jac else None)
         calc.peak_spectrum.curve.uncs = np.sqrt(np.diag(pcov))
         self._assign_peaks(calc)
 
+    def find_initial_peaks(self, spectrum):
+        """Return positions and heights `r1x, r1y, r2x, r2y` of R1 and R2
+        found in `spectrum` using `peak_finder`, cached with the spectrum"""
+        finder = getattr(self, f'_find_peaks_{self.peak_finder}', None)
+        if finder is None:
+            raise KeyError(f'Unknown peak finder "{self.peak_finder}"')
+        return spectrum.cached_on_data(f'{self.peak_finder} peaks',
+                                       lambda: finder(spectrum.x, spectrum.y))
+
     @staticmethod
-    def find_initial_peaks(spectrum):
-        x_span = max(spectrum.x) - min(spectrum.x)
-        caret_width = int(0.5 / (x_span / len(spectrum.x))) + 1
-        peak_indices = find_peaks_cwt(spectrum.y, [caret_width] * 3)
-        peaks = np.array([(spectrum.x[i], spectrum.y[i])
-                          for i in peak_indices])
-        peaks = peaks[peaks[:, 1].argsort()[::-1]]
+    def _find_peaks_fast(x, y):
+        """Find R1 as the highest local maximum of `y` smoothed over 0.2 nm
+        which stands out by 5% of its range and R2 as the highest one 1 to
+        3 nm below it; guess missing peaks using ambient positions"""
+        order = np.argsort(x)
+        x, y = x[order], np.asarray(y[order], dtype=float)
+        spacing = R1_0.nominal_value - R2_0.nominal_value
+        width = int(0.2 / ((x[-1] - x[0]) / len(x))) + 1 if len(x) > 1 else 1
+        smoothed = uniform_filter1d(y, size=width, mode='nearest')
+        indices, _ = find_peaks(smoothed, prominence=0.05 * np.ptp(smoothed))
+        indices = indices[np.argsort(smoothed[indices])[::-1]]
+        if len(indices) == 0:
+            return R1_0.nominal_value, max(y), R2_0.nominal_value, max(y) / 2
+        r1x, r1y = x[indices[0]], y[indices[0]]
+        for i in indices[1:]:
+            if r1x - 3.0 < x[i] < r1x - 1.0:
+                return r1x, r1y, x[i], y[i]
+        return r1x, r1y, r1x - spacing, r1y / 2
+
+    @staticmethod
+    def _find_peaks_cwt(x, y):
+        """Find R1 and R2 as the two highest peaks of `y` found using
+        continuous wavelet transform; slow, but tolerant of pathological
+        data. If R2 is not found 1 to 3 nm below R1, it is guessed"""
+        x_span = max(x) - min(x)
+        caret_width = int(0.5 / (x_span / len(x))) + 1
+        peak_indices = find_peaks_cwt(y, [caret_width] * 3)
+        peaks = np.array([(x[i], y[i]) for i in peak_indices])
         if len(peaks) == 0:
-            r1x = R1_0.nominal_value
-            r1y = max(spectrum.y)
-            r2x = R2_0.nominal_value
-            r2y = max(spectrum.y) / 2
-        elif len(peaks) == 1:
-            r1x = peaks[0][0]
-            r1y = peaks[0][1]
-            r2x = r1x * (1 - 0.002)
-            r2y = r1y / 2
-        else:
-            if peaks[0][0] - 3.0 < peaks[1][0] < peaks[0][0] - 1.0:
-                r1x = peaks[0][0]
-                r1y = peaks[0][1]
-                r2x = peaks[1][0]
-                r2y = peaks[1][1]
-            else:
-                r1x = peaks[0][0]
-                r1y = peaks[0][1]
-                r2x = r1x * (1 - 0.002)
-                r2y = r1y / 2
-        return r1x, r1y, r2x, r2y
+            return R1_0.nominal_value, max(y), R2_0.nominal_value, max(y) / 2
+        peaks = peaks[peaks[:, 1].argsort()[::-1]]
+        r1x, r1y = peaks[0]
+        if len(peaks) > 1 and r1x - 3.0 < peaks[1][0] < r1x - 1.0:
+            return r1x, r1y, peaks[1][0], peaks[1][1]
+        return r1x, r1y, r1x * (1 - 0.002), r1y / 2
+
+    def peakfit_stack(self, stack, max_iterations=100):
+        """
+        Fit peaks to every background-subtracted spectrum in `stack` at once
+        using batched Levenberg-Marquardt, each within its own focus around
+        initially found peaks, as in `peakfit`. Positions of spectra whose
+        fit has not converged are returned as NaN.
+
+        :param stack: `SpectrumStack` of spectra with background removed.
+        :param max_iterations: Maximum number of steps for every spectrum.
+        :return: Array of shape (len(stack), 2) with positions of R1 and R2
+            and array of shape (len(stack), 2, 2) with their covariance.
+        """
+        peaks = [self.find_initial_peaks(spectrum) for spectrum in stack]
+        p0 = np.array([self._initial_args(*p) for p in peaks], dtype=float)
+        half = self.focus_width / 2
+        centers = np.array(peaks, dtype=float)[:, [0, 2], np.newaxis]
+        x = stack.x[np.newaxis, np.newaxis, :]
+        mask = np.any((x >= centers - half) & (x <= centers + half), axis=1)
+        popt, pcov, _, converged = batched_curve_fit(
+            self.model, stack.x, stack.y, p0, mask=mask,
+            max_iterations=max_iterations, full_output=True)
+        indices = list(self.position_indices)
+        positions = popt[:, indices]
+        covariance = pcov[:, indices][:, :, indices]
+        positions[~converged] = np.nan
+        covariance[~converged] = np.nan
+        return positions, covariance
 
     @staticmethod
     def ufloat_from_curve_args(curve, index):
@@ -80,70 +164,108 @@ class BasePeakfittingStrategy(PeakfittingStrategy):
 @PeakfittingStrategies.register(default=True)
 class GaussianPeakfittingStrategy(BasePeakfittingStrategy):
     name = 'Gaussian'
+    focus_width = 0.5
+    position_indices = (1, 4)
 
-    def _prepare_peakfit(self, calc):
-        def two_gaussians(x, _a1, _mu1, _si1, _a2, _mu2, _si2):
-            return gaussian(_a1, _mu1, _si1)(x) + gaussian(_a2, _mu2, _si2)(x)
-        mu1, a1, mu2, a2 = self.find_initial_peaks(calc.peak_spectrum)
-        si1 = si2 = 0.3
-        calc.peak_spectrum.curve = Curve(func=two_gaussians,
-                                         args=(a1, mu1, si1, a2, mu2, si2))
-        peaks = self.find_initial_peaks(calc.peak_spectrum)
-        calc.peak_spectrum.focus_on_points((peaks[0], peaks[2]), width=0.5)
-        calc.peak_spectrum.sigma_type = 'equal'
+    @staticmethod
+    def _create_model():
+        return GaussianModel() + GaussianModel()
 
-    def _assign_peaks(self, calc):
-        curve = calc.peak_spectrum.curve
-        calc.r1 = self.ufloat_from_curve_args(curve, index=1)
-        calc.r2 = self.ufloat_from_curve_args(curve, index=4)
+    def _initial_args(self, mu1, a1, mu2, a2):
+        si1 = si2 = 0.3
+        return a1, mu1, si1, a2, mu2, si2
 
 
 @PeakfittingStrategies.register()
 class PseudovoigtPeakfittingStrategy(BasePeakfittingStrategy):
     name = 'Pseudovoigt'
+    focus_width = 1.0
+    position_indices = (1, 5)
 
-    def _prepare_peakfit(self, calc):
-        def two_pseudovoigts(x, _a1, _mu1, _w1, _et1, _a2, _mu2, _w2, _et2):
-            return pseudovoigt(_a1, _mu1, _w1, _et1)(x) + \
-                   pseudovoigt(_a2, _mu2, _w2, _et2)(x)
+    @staticmethod
+    def _create_model():
+        return PseudovoigtModel() + PseudovoigtModel()
 
-        mu1, a1, mu2, a2 = self.find_initial_peaks(calc.peak_spectrum)
+    def _initial_args(self, mu1, a1, mu2, a2):
         w1 = w2 = 0.6
         et1 = et2 = 0.5
-        calc.peak_spectrum.curve = Curve(
-            func=two_pseudovoigts,
-            args=(a1, mu1, w1, et1, a2, mu2, w2, et2))
-        peaks = self.find_initial_peaks(calc.peak_spectrum)
-        calc.peak_spectrum.focus_on_points((peaks[0], peaks[2]), width=1.0)
-        calc.peak_spectrum.sigma_type = 'equal'
-
-    def _assign_peaks(self, calc):
-        curve = calc.peak_spectrum.curve
-        calc.r1 = self.ufloat_from_curve_args(curve, index=1)
-        calc.r2 = self.ufloat_from_curve_args(curve, index=5)
+        return a1, mu1, w1, et1, a2, mu2, w2, et2
 
 
 @PeakfittingStrategies.register()
 class CamelPeakfittingStrategy(BasePeakfittingStrategy):
     name = 'Camel'
+    focus_width = 1.0
+    position_indices = (1, 4)
 
-    def _prepare_peakfit(self, calc):
-        def camel(x, _a1, _mu1, _si1, _a2, _mu2, _si2, _a, _si):
-            return gaussian(_a2, _mu2, _si2)(x) + gaussian(_a1, _mu1, _si1)(x) \
-                   + gaussian(_a, (_mu2 + _mu1) / 2, _si)(x)
-        mu1, a1, mu2, a2 = self.find_initial_peaks(calc.peak_spectrum)
+    @staticmethod
+    def _create_model():
+        return CamelModel()
+
+    def _initial_args(self, mu1, a1, mu2, a2):
         si1, si2, si, a = 0.35, 0.35, 1.0, a1 / 10
-        calc.peak_spectrum.curve = Curve(
-            func=camel,
-            args=(a1, mu1, si1, a2, mu2, si2, a, si))
-        peaks = self.find_initial_peaks(calc.peak_spectrum)
-        calc.peak_spectrum.focus_on_points((peaks[0], peaks[2]), width=1.0)
-        calc.peak_spectrum.sigma_type = 'equal'
+        return a1, mu1, si1, a2, mu2, si2, a, si
 
-    def _assign_peaks(self, calc):
-        curve = calc.peak_spectrum.curve
-        calc.r1 = self.ufloat_from_curve_args(curve, index=1)
-        calc.r2 = self.ufloat_from_curve_args(curve, index=4)
+
+class JointPeakfittingStrategy(PeakfittingStrategy, abc.ABC):
+    """
+    Fit linear background and peaks of `peakfitter_type` to the whole raw
+    spectrum together in a single trust-region run with Huber loss, which
+    limits the influence of residuals larger than `f_scale` times the largest
+    intensity. Replaces backfitting, so the engine's backfitter is not used.
+    """
+    fits_background = True
+    degree = 1
+    f_scale = 0.05
+
+    @property
+    @abc.abstractmethod
+    def peakfitter_type(self) -> type:
+        raise NotImplementedError
+
+    def __init__(self):
+        self.peakfitter = self.peakfitter_type()
+        self.background_model = PolynomialModel(degree=self.degree)
+        self.model = self.background_model + self.peakfitter.model
+
+    def _prepare_peakfit(self, calc):
+        calc.back_spectrum = calc.raw_spectrum.copy()
+        spectrum = calc.back_spectrum
+        args = chord_coefficients(spectrum.x, spectrum.y, self.degree)
+        spectrum.curve = Curve(func=self.background_model, vectorized=True,
+                               args=tuple(args),
+                               jac=self.background_model.jacobian)
+        calc.peak_spectrum = calc.raw_spectrum.copy(
+            y=calc.raw_spectrum.y - spectrum.f)
+        self.peakfitter._prepare_peakfit(calc)
+
+    def peakfit(self, calc):
+        self._prepare_peakfit(calc)
+        back_curve = calc.back_spectrum.curve
+        peak_curve = calc.peak_spectrum.curve
+        p0 = tuple(back_curve.args) + tuple(peak_curve.args)
+        args, pcov = scaled_curve_fit(
+            self.model, calc.raw_spectrum.x, calc.raw_spectrum.y, p0=p0,
+            method='trf', loss='huber', f_scale=self.f_scale)
+        uncs = np.sqrt(np.diag(pcov))
+        n = len(self.background_model)
+        back_curve.args, back_curve.uncs = tuple(args[:n]), uncs[:n]
+        peak_curve.args, peak_curve.uncs = tuple(args[n:]), uncs[n:]
+        calc.back_spectrum.y = calc.back_spectrum.f
+        calc.peak_spectrum.y = calc.raw_spectrum.y - calc.back_spectrum.y
+        self.peakfitter._assign_peaks(calc)
+
+
+@PeakfittingStrategies.register()
+class JointGaussianPeakfittingStrategy(JointPeakfittingStrategy):
+    name = 'Joint Gaussian'
+    peakfitter_type = GaussianPeakfittingStrategy
+
+
+@PeakfittingStrategies.register()
+class JointPseudovoigtPeakfittingStrategy(JointPeakfittingStrategy):
+    name = 'Joint Pseudovoigt'
+    peakfitter_type = PseudovoigtPeakfittingStrategy
 
 
 @PeakfittingStrategies.register()
@@ -1,9 +1,33 @@
 import abc
+import bz2
+import gzip
+import itertools
+import lzma
 import numpy as np
 from collections import OrderedDict
+from typing import NamedTuple, Tuple
 from uncertainties import ufloat_fromstr
 from pruby.strategies.base import BaseStrategy, BaseStrategies
 from pruby.spectrum import Spectrum
+from pruby.utility import SpectrumCache, polynomial
+
+
+COMPRESSION_MAGIC_BYTES = {
+    b'\x1f\x8b': gzip.open,
+    b'BZh': bz2.open,
+    b'\xfd7zXZ\x00': lzma.open,
+}
+
+
+def open_text(path):
+    """Open text file at path for reading, decompressing gzip, bz2 or xz
+    streams on the fly if they are recognised by their magic bytes."""
+    with open(path, 'rb') as file:
+        header = file.read(max(len(m) for m in COMPRESSION_MAGIC_BYTES))
+    for magic_bytes, open_function in COMPRESSION_MAGIC_BYTES.items():
+        if header.startswith(magic_bytes):
+            return open_function(path, 'rt')
+    return open(path, 'r')
 
 
 class ReadingStrategy(BaseStrategy, abc.ABC):
@@ -12,42 +36,139 @@ class ReadingStrategy(BaseStrategy, abc.ABC):
     def read(calc):
         raise NotImplementedError
 
+    def frames(self, calc):
+        """Yield consecutive raw spectra stored in `calc.dat_path`"""
+        self.read(calc)
+        yield calc.raw_spectrum
+
 
 class ReadingStrategies(BaseStrategies):
     registry = OrderedDict()
     strategy_type = ReadingStrategy
+    cache = SpectrumCache()
 
 
-@ReadingStrategies.register()
-class RawTxtReadingStrategy(ReadingStrategy):
-    name = 'Raw spectrum txt'
+class BaseTxtReadingStrategy(ReadingStrategy, abc.ABC):
+    chunk_size = 1024
+
+    @classmethod
+    @abc.abstractmethod
+    def _parse(cls, path, limits=None):
+        raise NotImplementedError
 
     @staticmethod
-    def read(calc):
-        data = np.loadtxt(calc.dat_path, dtype=(float, float))
-        x_list, y_list = data[:, 0], data[:, 1]
+    def _crop_chunks(chunks, limits=None):
+        """
+        Concatenate x, y arrays from consecutive `chunks`, discarding points
+        outside of `limits`' span. Stop early once x, if non-decreasing
+        so far, passes the right edge of `limits`.
+        """
+        bounds = list(limits) if limits is not None else []
+        left, right = (min(bounds), max(bounds)) if bounds else \
+            (-float('inf'), float('inf'))
+        x_chunks, y_chunks = [np.array([])], [np.array([])]
+        ascending, previous_x = True, -float('inf')
+        for x_chunk, y_chunk in chunks:
+            if len(x_chunk) == 0:
+                continue
+            in_limits = (x_chunk >= left) & (x_chunk <= right)
+            x_chunks.append(x_chunk[in_limits])
+            y_chunks.append(y_chunk[in_limits])
+            ascending = ascending and previous_x <= x_chunk[0] and \
+                bool(np.all(np.diff(x_chunk) >= 0))
+            previous_x = x_chunk[-1]
+            if ascending and previous_x > right:
+                break
+        return np.concatenate(x_chunks), np.concatenate(y_chunks)
+
+    @classmethod
+    def read(cls, calc):
+        cache_key = f'{cls.name}: {calc.limits!r}'
+        data = ReadingStrategies.cache.load(calc.dat_path, cache_key)
+        if data is None:
+            data = cls._parse(calc.dat_path, limits=calc.limits)
+            ReadingStrategies.cache.store(calc.dat_path, cache_key, *data)
+        x_list, y_list = data
         calc.raw_spectrum = Spectrum(x_list, y_list).within(calc.limits)
 
 
+@ReadingStrategies.register()
+class RawTxtReadingStrategy(BaseTxtReadingStrategy):
+    name = 'Raw spectrum txt'
+
+    @classmethod
+    def _iterate_chunks(cls, file):
+        while True:
+            lines = list(itertools.islice(file, cls.chunk_size))
+            if not lines:
+                break
+            data = np.loadtxt(lines, dtype=(float, float), ndmin=2)
+            if data.size == 0:
+                continue
+            yield data[:, 0], data[:, 1]
+
+    @classmethod
+    def _parse(cls, path, limits=None):
+        with open_text(path) as file:
+            return cls._crop_chunks(cls._iterate_chunks(file), limits)
+
+
 @ReadingStrategies.register(default=True)
-class MetaTxtReadingStrategy(ReadingStrategy):
+class MetaTxtReadingStrategy(BaseTxtReadingStrategy):
     name = 'Metadata spectrum txt'
 
     @staticmethod
-    def read(calc):
-        with open(calc.dat_path, 'r') as file:
-            x_list, y_list = [], []
-            for line in file.readlines():
-                try:
-                    split_line = line.strip().split()
-                    new_x = float(split_line[0])
-                    new_y = float(split_line[1])
-                except ValueError:
-                    pass
-                else:
-                    x_list.append(new_x)
-                    y_list.append(new_y)
-        calc.raw_spectrum = Spectrum(x_list, y_list).within(calc.limits)
+    def _parse_line(line):
+        split_line = line.strip().split()
+        return float(split_line[0]), float(split_line[1])
+
+    @classmethod
+    def _is_data_line(cls, line):
+        try:
+            cls._parse_line(line)
+        except (ValueError, IndexError):
+            return False
+        return True
+
+    @classmethod
+    def _read_tolerantly(cls, lines):
+        x_list, y_list = [], []
+        for line in lines:
+            try:
+                new_x, new_y = cls._parse_line(line)
+            except (ValueError, IndexError):
+                pass
+            else:
+                x_list.append(new_x)
+                y_list.append(new_y)
+        return np.array(x_list), np.array(y_list)
+
+    @classmethod
+    def _iterate_chunks(cls, lines):
+        """Parse the numeric block between header and footer in chunks,
+        falling back to line-by-line parsing for the malformed ones"""
+        start = next((i for i, line in enumerate(lines)
+                      if cls._is_data_line(line)), len(lines))
+        stop = next((i + 1 for i in range(len(lines) - 1, start - 1, -1)
+                     if cls._is_data_line(lines[i])), start)
+        for chunk_start in range(start, stop, cls.chunk_size):
+            chunk = lines[chunk_start:min(chunk_start + cls.chunk_size, stop)]
+            try:
+                data = np.loadtxt(chunk, usecols=(0, 1), ndmin=2)
+            except ValueError:
+                yield cls._read_tolerantly(chunk)
+            else:
+                yield data[:, 0], data[:, 1]
+
+    @classmethod
+    def _read_vectorized(cls, lines, limits=None):
+        return cls._crop_chunks(cls._iterate_chunks(lines), limits)
+
+    @classmethod
+    def _parse(cls, path, limits=None):
+        with open_text(path) as file:
+            lines = file.read().splitlines()
+        return cls._read_vectorized(lines, limits)
 
 
 @ReadingStrategies.register()
@@ -56,7 +177,7 @@ class SingleLineReadingStrategy(ReadingStrategy):
 
     @staticmethod
     def read(calc):
-        with open(calc.dat_path, 'r') as file:
+        with open_text(calc.dat_path) as file:
             first_line = file.readline().split()
             r1 = ufloat_fromstr(first_line[0])
             try:
@@ -65,3 +186,134 @@ class SingleLineReadingStrategy(ReadingStrategy):
                 intensity = 1
         calc.raw_spectrum = calc.peak_spectrum = Spectrum([r1], [intensity])
         calc.r1 = r1
+
+
+class BaseSeriesReadingStrategy(ReadingStrategy, abc.ABC):
+    """Base for strategies reading multiple frames from a single file lazily,
+    so that only a bounded portion of the file is kept in memory at once"""
+
+    @abc.abstractmethod
+    def _iterate_frames(self, path, limits=None):
+        raise NotImplementedError
+
+    @staticmethod
+    def _locate_rows_in_limits(x_list, limits):
+        """Return slice of sorted or mask of unsorted x in span of limits"""
+        bounds = list(limits) if limits is not None else []
+        if not bounds:
+            return slice(0, len(x_list))
+        left, right = min(bounds), max(bounds)
+        if np.all(np.diff(x_list) >= 0):
+            first_row = int(np.searchsorted(x_list, left, side='left'))
+            last_row = int(np.searchsorted(x_list, right, side='right'))
+            return slice(first_row, last_row)
+        return (x_list >= left) & (x_list <= right)
+
+    def frames(self, calc):
+        frames = self._iterate_frames(calc.dat_path, limits=calc.limits)
+        for x_list, y_list in frames:
+            yield Spectrum(x_list, y_list).within(calc.limits)
+
+    def read(self, calc):
+        calc.raw_spectrum = next(self.frames(calc), Spectrum())
+
+
+@ReadingStrategies.register()
+class ColumnSeriesReadingStrategy(BaseSeriesReadingStrategy):
+    """Read file with a column of x followed by one column of y per frame"""
+    name = 'Column series txt'
+
+    @staticmethod
+    def _read_data_block(path):
+        """Return array with all columns of the first block of data lines"""
+        block = []
+        with open_text(path) as file:
+            for line in file:
+                if MetaTxtReadingStrategy._is_data_line(line):
+                    block.append(line)
+                elif block:
+                    break
+        return np.loadtxt(block, ndmin=2) if block else np.empty((0, 1))
+
+    def _iterate_frames(self, path, limits=None):
+        data = self._read_data_block(path)
+        in_limits = self._locate_rows_in_limits(data[:, 0], limits)
+        data = data[in_limits]
+        for y_list in data[:, 1:].T:
+            yield data[:, 0], y_list
+
+
+@ReadingStrategies.register()
+class SectionSeriesReadingStrategy(BaseSeriesReadingStrategy):
+    """Read file with repeated sections of metadata header and x, y data"""
+    name = 'Section series txt'
+
+    def _iterate_frames(self, path, limits=None):
+        reader = MetaTxtReadingStrategy
+        block = []
+        with open_text(path) as file:
+            for line in file:
+                if reader._is_data_line(line):
+                    block.append(line)
+                elif block:
+                    yield reader._read_vectorized(block, limits)
+                    block = []
+        if block:
+            yield reader._read_vectorized(block, limits)
+
+
+class BinaryFormat(NamedTuple):
+    """
+    Layout of a binary spectrometer file: a file header of `header_length`
+    bytes followed by frames, each of `frame_header_length` bytes of header
+    and `pixel_count` intensities of numpy `dtype`. Wavelength of n-th pixel
+    is given by a polynomial of n with coefficients `calibration`.
+    """
+    header_length: int = 0
+    dtype: str = '<f4'
+    pixel_count: int = 2048
+    calibration: Tuple[float, ...] = (0.0, 1.0)
+    frame_header_length: int = 0
+
+
+class BinaryReadingStrategy(BaseSeriesReadingStrategy):
+    """
+    Read frames of binary spectrometer files as memory-mapped views.
+    Since the layout of a file can not be guessed, this strategy is not
+    registered and must be assigned to `engine.reader` with its format.
+    """
+    name = 'Binary spectrum'
+
+    def __init__(self, binary_format: BinaryFormat):
+        if not isinstance(binary_format, BinaryFormat):
+            raise TypeError('BinaryReadingStrategy requires a BinaryFormat '
+                            'describing layout and calibration of the file')
+        self.binary_format = binary_format
+
+    def _memory_map(self, path):
+        fmt = self.binary_format
+        frame_dtype = np.dtype([('header', f'V{fmt.frame_header_length}'),
+                                ('y', fmt.dtype, (fmt.pixel_count,))])
+        frames = np.memmap(path, dtype=frame_dtype, mode='r',
+                           offset=fmt.header_length)
+        x_list = polynomial(*fmt.calibration)(
+            np.arange(fmt.pixel_count, dtype=float))
+        return x_list, frames['y']
+
+    def _iterate_frames(self, path, limits=None):
+        x_list, y_lists = self._memory_map(path)
+        in_limits = self._locate_rows_in_limits(x_list, limits)
+        for y_list in y_lists:
+            yield x_list[in_limits], y_list[in_limits]
+
+    def frames(self, calc):
+        """Yield spectra sharing memory with file if `calc.limits` allow"""
+        x_list, _ = self._memory_map(calc.dat_path)
+        in_limits = self._locate_rows_in_limits(x_list, calc.limits)
+        is_view = isinstance(in_limits, slice) and len(list(calc.limits)) == 2
+        frames = self._iterate_frames(calc.dat_path, limits=calc.limits)
+        for x_list, y_list in frames:
+            if is_view:
+                yield Spectrum(x_list, y_list, focus=calc.limits, copy=False)
+            else:
+                yield Spectrum(x_list, y_list).within(calc.limits)
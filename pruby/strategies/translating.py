@@ -3,6 +3,7 @@ from collections import OrderedDict
 from pruby.strategies.base import BaseStrategy, BaseStrategies
 from uncertainties import ufloat
 from pruby.constants import R1_0
+from pruby.utility import Polynomial
 
 
 def mao_function(r1, a, b):
@@ -60,10 +61,11 @@ class PiermariniTranslatingStrategy(TranslatingStrategy):
     name = 'Piermarini'
     year = 1975
     reference = r'https://doi.org/10.1063/1.321957'
+    pressure = Polynomial(0.0, ufloat(2.740, 0.016))
 
     def translate(self, calc):
         r1 = calc.r1 - calc.offset + calc.t_correction
-        calc.p = ufloat(2.740, 0.016) * (r1 - R1_0)
+        calc.p = self.pressure(r1 - R1_0)
 
 
 @TranslatingStrategies.register(default=True)
@@ -71,12 +73,14 @@ class Ruby2020TranslatingStrategy(TranslatingStrategy):
     name = 'Ruby2020'
     year = 2020
     reference = r'https://doi.org/10.1080/08957959.2020.1791107'
+    r1_0 = ufloat(694.25, 0.01)
+    a = ufloat(1870, 10)
+    pressure = Polynomial(0.0, a, a * ufloat(5.63, 0.03))
 
     def translate(self, calc):
         r1 = calc.r1 - calc.offset + calc.t_correction
-        r1_0_ruby2020 = ufloat(694.25, 0.01)
-        r_rel = (r1 - r1_0_ruby2020) / r1_0_ruby2020
-        calc.p = ufloat(1870, 10) * r_rel * (1 + ufloat(5.63, 0.03) * r_rel)
+        r_rel = (r1 - self.r1_0) / self.r1_0
+        calc.p = self.pressure(r_rel)
 
 
 @TranslatingStrategies.register()
@@ -85,19 +89,17 @@ class WeiTranslatingStrategy(TranslatingStrategy):
     year = 2011
     reference = r'https://doi.org/10.1063/1.3624618'
 
+    a_t = Polynomial(ufloat(1915.0, 0.9), ufloat(0.622, 0.007))
+    b_t = Polynomial(ufloat(9.28, 0.02), ufloat(-0.024, 0.003),
+                     ufloat(-8.2e-7, 0.02e-7))
+    la_t = Polynomial(694.2, ufloat(0.0063, 0.0002))
+
     def translate(self, calc):
         r1 = calc.r1 - calc.offset
-        a300 = ufloat(1915.0, 0.9)
-        a1 = ufloat(0.622, 0.007)
-        b300 = ufloat(9.28, 0.02)
-        b1 = ufloat(-0.024, 0.003)
-        b2 = ufloat(-8.2e-7, 0.02e-7)
-        la300 = ufloat(694.2, 0.0)
-        la1 = ufloat(0.0063, 0.0002)
         dt = calc.t - 298.0
-        a = a300 + a1 * dt
-        b = b300 + b1 * dt + b2 * dt ** 2
-        la_t = la300 + la1 * dt
+        a = self.a_t(dt)
+        b = self.b_t(dt)
+        la_t = self.la_t(dt)
         calc.p = (a / b) * (pow(r1 / la_t, b) - 1.0)
 
 # TODO: use years when generating strategy names
@@ -1,3 +1,6 @@
+from .cache import SpectrumCache
 from .cycle import cycle
 from .line_subset import LineSubset
-from .functions import polynomial, gaussian, lorentzian, pseudovoigt
+from .functions import Polynomial, polynomial, gaussian, lorentzian, pseudovoigt
+from .models import Parameter, Model, PolynomialModel, GaussianModel, \
+    LorentzianModel, PseudovoigtModel, SumModel, CamelModel
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import pathlib
+import threading
+
+import numpy as np
+
+
+def user_cache_directory():
+    """Return per-user directory for cached files of pRuby"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or \
+            pathlib.Path.home().joinpath('AppData', 'Local')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or \
+            pathlib.Path.home().joinpath('.cache')
+    return pathlib.Path(base).joinpath('pruby')
+
+
+class SpectrumCache:
+    """
+    Binary sidecar cache of parsed spectra. Each entry holds x and y arrays
+    stacked in a single `.npy` file, keyed by file path, size, modification
+    time and reader name, and is memory-mapped when read back. The least
+    recently used entries are evicted once the cache exceeds `max_size` bytes.
+    By default, entries are kept in a per-user `user_cache_directory()`.
+    Size bookkeeping and eviction are guarded by a lock, so that entries
+    can be stored by concurrent threads.
+    """
+
+    def __init__(self, directory=None, max_size=256 * 2 ** 20, enabled=True):
+        self.directory = pathlib.Path(directory) if directory \
+            else user_cache_directory()
+        self.max_size: int = max_size
+        self.enabled: bool = enabled
+        self._size = None
+        self._lock = threading.RLock()
+
+    def _entry_path(self, path, reader_name):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = '|'.join([os.path.abspath(path), str(stat.st_size),
+                        str(stat.st_mtime_ns), reader_name])
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return self.directory.joinpath(digest + '.npy')
+
+    def load(self, path, reader_name):
+        """Return memory-mapped x, y arrays cached for path
+        or None if they are absent"""
+        if not self.enabled:
+            return None
+        entry_path = self._entry_path(path, reader_name)
+        if entry_path is None or not entry_path.is_file():
+            return None
+        try:
+            data = np.load(entry_path, mmap_mode='r')
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            return None
+        return data[0], data[1]
+
+    def store(self, path, reader_name, x, y):
+        """Write x, y arrays read from path into cache and evict if needed"""
+        if not self.enabled:
+            return
+        entry_path = self._entry_path(path, reader_name)
+        if entry_path is None:
+            return
+        try:
+            self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+            temp_path = entry_path.with_suffix(
+                f'.{os.getpid()}.{threading.get_ident()}.tmp')
+            with open(temp_path, 'wb') as temp_file:
+                np.save(temp_file, np.vstack([x, y]).astype(float))
+        except OSError:
+            return
+        with self._lock:
+            try:
+                if self._size is None:
+                    self._size = sum(size for _, size, _ in self._entries())
+                replaced_size = entry_path.stat().st_size \
+                    if entry_path.is_file() else 0
+                os.replace(temp_path, entry_path)
+                self._size += entry_path.stat().st_size - replaced_size
+            except OSError:
+                return
+            if self._size > self.max_size:
+                self.evict()
+
+    def _entries(self):
+        """Return list of modification time, size and path of every entry"""
+        entries = []
+        for entry in self.directory.glob('*.npy'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until below `self.max_size`"""
+        with self._lock:
+            entries = self._entries()
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries, key=lambda e: e[0]):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    entry.unlink()
+                except OSError:
+                    continue
+                total_size -= size
+            self._size = total_size
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        with self._lock:
+            for entry in self.directory.glob('*.npy'):
+                try:
+                    entry.unlink()
+                except OSError:
+                    pass
+            self._size = None
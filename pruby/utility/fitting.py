@@ -0,0 +1,388 @@
+"""
+Closed-form iteratively reweighted least squares (IRLS) fitting of polynomial
+backgrounds. Each reweighting step is a weighted linear least squares problem
+solved directly from normal equations in centered and scaled coordinates.
+All functions accept a single spectrum `y` of shape (n, ) or a batch of
+spectra sharing x as an array of shape (m, n) and solve all of them at once.
+Non-polynomial baselines are estimated using asymmetrically reweighted
+penalized least squares (arPLS), where each step is a banded O(n) solve.
+"""
+
+from functools import lru_cache
+import numpy as np
+from scipy import sparse
+from scipy.linalg import solveh_banded
+from scipy.optimize import curve_fit
+from scipy.special import comb, expit
+from . import kernels
+
+
+def equal_sigma(delta):
+    """Return unit sigma for every residual in `delta`"""
+    return np.ones_like(delta)
+
+
+def huber_sigma(delta):
+    """Return Huber sigma of residuals `delta`, evaluated for each row
+    separately by the huber sigma kernel of current `kernels.backend`"""
+    delta = np.ascontiguousarray(delta, dtype=float)
+    sigma = np.empty_like(delta)
+    for row, out in zip(np.atleast_2d(delta), np.atleast_2d(sigma)):
+        kernels.backend.huber_sigma(row, out)
+    return sigma
+
+
+SIGMA_FUNCTIONS = {'equal': equal_sigma, 'huber': huber_sigma}
+
+
+def _substitution_matrix(order, offset, factor):
+    """Matrix T such that coefficients of p(x) @ T are coefficients
+    of q(u) = p(offset + factor * u), both of polynomials of `order`"""
+    transform = np.zeros((order, order))
+    for i in range(order):
+        for j in range(i + 1):
+            transform[i, j] = comb(i, j, exact=True) * \
+                              offset ** (i - j) * factor ** j
+    return transform
+
+
+def substitute_polynomial(coefficients, offset, factor):
+    """Transform increasing order coefficients of polynomial p(x) into
+    coefficients of polynomial q(u) = p(offset + factor * u)"""
+    coefficients = np.asarray(coefficients, dtype=float)
+    order = coefficients.shape[-1]
+    return coefficients @ _substitution_matrix(order, offset, factor)
+
+
+def _scaling(x):
+    """Return center and half-width used to map `x` onto [-1, 1]"""
+    center = (x.max() + x.min()) / 2
+    scale = (x.max() - x.min()) / 2 or 1.0
+    return center, scale
+
+
+def _solve_weighted(vandermonde, y, weights):
+    """Solve normal equations of weighted linear least squares row-wise"""
+    matrix = np.einsum('...i,ij,ik->...jk', weights, vandermonde, vandermonde)
+    vector = np.einsum('...i,ij->...j', weights * y, vandermonde)
+    return np.linalg.solve(matrix, vector[..., np.newaxis])[..., 0]
+
+
+def chord_coefficients(x, y, degree=1):
+    """Return increasing order coefficients of polynomial of `degree` equal
+    to the line passing through the first and last point of each row of y"""
+    x = np.asarray(x, dtype=float)
+    rows = np.atleast_2d(np.asarray(y, dtype=float))
+    slope = (rows[:, -1] - rows[:, 0]) / (x[-1] - x[0])
+    chord = np.column_stack([rows[:, 0] - slope * x[0], slope])
+    coefficients = np.zeros((len(rows), degree + 1))
+    coefficients[:, :2] = chord[:, :degree + 1]
+    return coefficients[0] if np.ndim(y) == 1 else coefficients
+
+
+def weighted_polynomial_fit(x, y, weights, degree=1):
+    """
+    Return increasing order coefficients of polynomial of `degree` which
+    minimises sum of `weights` * (y - polynomial(x)) ** 2 for every row of y.
+    The normal equations are solved for x centered and scaled to [-1, 1]
+    and the solution is transformed back to the original x.
+    """
+    x = np.asarray(x, dtype=float)
+    center, scale = _scaling(x)
+    vandermonde = np.vander((x - center) / scale, degree + 1, increasing=True)
+    weights = np.broadcast_to(weights, np.shape(y))
+    scaled = _solve_weighted(vandermonde, y, weights)
+    return substitute_polynomial(scaled, -center / scale, 1 / scale)
+
+
+def parameter_transform(parameters, center, scale, norm):
+    """
+    Return `offset` and `matrix` mapping parameters p' of a model fit to
+    u = (x - center) / scale and v = y / norm onto parameters p = offset
+    + matrix @ p' of the same model for x and y, based on their kinds.
+    Runs of polynomial coefficients must start with the power of 0.
+    """
+    offset = np.zeros(len(parameters))
+    matrix = np.zeros((len(parameters), len(parameters)))
+    for i, parameter in enumerate(parameters):
+        if parameter.kind == 'amplitude':
+            matrix[i, i] = norm
+        elif parameter.kind == 'position':
+            offset[i], matrix[i, i] = center, scale
+        elif parameter.kind == 'width':
+            matrix[i, i] = scale
+        elif parameter.kind == 'shape':
+            matrix[i, i] = 1.0
+        elif parameter.kind == 'coefficient':
+            start = i - parameter.power
+            order = parameter.power + 1
+            block = norm * _substitution_matrix(
+                order, -center / scale, 1 / scale).T
+            matrix[start:i + 1, start:i + 1] = block
+        else:
+            raise ValueError(f'Unknown kind of parameter "{parameter.kind}"')
+    return offset, matrix
+
+
+def scaled_curve_fit(model, x, y, p0, sigma=None, **kwargs):
+    """
+    Fit `model` to `x`, `y` using `curve_fit` with its analytic jacobian
+    after mapping x onto [-1, 1] and y onto [-1, 1] in order to improve
+    conditioning. Return optimal parameters and covariance of the model
+    for the original x and y, mapped back using metadata of its parameters.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    center, scale = _scaling(x)
+    norm = np.max(np.abs(y)) or 1.0
+    offset, matrix = parameter_transform(model.parameters, center, scale, norm)
+    p0_scaled = np.linalg.solve(matrix, np.asarray(p0, dtype=float) - offset)
+    sigma = None if sigma is None else np.asarray(sigma, dtype=float) / norm
+    popt, pcov = curve_fit(model, (x - center) / scale, y / norm,
+                           p0=p0_scaled, sigma=sigma, jac=model.jacobian,
+                           **kwargs)
+    return offset + matrix @ popt, matrix @ pcov @ matrix.T
+
+
+def _compact_index(mask):
+    """Return array of shape (m, k) with indices of True values in every row
+    of `mask` of shape (m, n) first, where k is their largest count in any
+    row; shorter rows are padded with indices of their False values"""
+    counts = np.count_nonzero(mask, axis=-1)
+    order = np.argsort(~mask, axis=-1, kind='stable')
+    return order[:, :max(counts.max(initial=0), 1)]
+
+
+def batched_curve_fit(model, x, y, p0, sigma=None, mask=None,
+                      max_iterations=100, tolerance=1e-10, full_output=False):
+    """
+    Fit `model` independently to every row of `y` using Levenberg-Marquardt
+    steps taken for all rows at once: jacobians of all rows are stacked and
+    their small damped normal equations are solved in one batched call.
+    Every row is masked out of further steps once either its relative step
+    or relative decrease of chi-square drops below `tolerance`, or once
+    increasing damping can not decrease its chi-square any further.
+    As in `scaled_curve_fit`, x and every row of y are mapped onto [-1, 1].
+
+    :param model: `Model` evaluated for parameters of shape (m, 1) each.
+    :param x: Array of shape (n, ) with positions common for all rows.
+    :param y: Array of shape (m, n) with intensities of m spectra.
+    :param p0: Array of shape (m, len(model)) with initial parameters.
+    :param sigma: Relative uncertainties of y, broadcastable to its shape.
+    :param mask: Boolean array broadcastable to y selecting points to be fit;
+        only these points are evaluated, so narrow masks make fits faster.
+    :param max_iterations: Maximum number of steps for every row.
+    :param tolerance: Relative step and decrease of chi-square to stop at.
+    :param full_output: If True, return also the number of iterations taken
+        by every row and a boolean mask of rows which have converged.
+    :return: Optimal parameters of shape (m, len(model)) and their covariance
+        of shape (m, len(model), len(model)), scaled by reduced chi-square
+        as in `curve_fit` with default `absolute_sigma=False`.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    rows, size = len(y), len(model)
+    center, scale = _scaling(x)
+    norm = np.max(np.abs(y), axis=-1)
+    norm[norm == 0] = 1.0
+    offset, matrix = parameter_transform(model.parameters, center, scale, 1.0)
+    scales_with_y = np.isin(model.kinds, ('amplitude', 'coefficient'))
+    row_scale = np.where(scales_with_y, norm[:, np.newaxis], 1.0)
+    inverse_sigma = np.ones(y.shape) if sigma is None \
+        else np.broadcast_to(sigma, y.shape) ** -1.0
+    index = np.broadcast_to(np.arange(len(x)), y.shape)
+    if mask is not None:
+        mask = np.broadcast_to(mask, y.shape)
+        index = _compact_index(mask)
+        inverse_sigma = np.take_along_axis(inverse_sigma, index, axis=-1) \
+            * np.take_along_axis(mask, index, axis=-1)
+    points = np.count_nonzero(inverse_sigma, axis=-1)
+    u = ((x - center) / scale)[index]
+    v = np.take_along_axis(y, index, axis=-1) / norm[:, np.newaxis]
+
+    value = np.empty(u.shape)
+    jacobian = np.empty(u.shape + (size, ))
+
+    def columns(params):
+        return tuple(params.T[..., np.newaxis])
+
+    def weighted_residual(params):
+        model.evaluate(u, columns(params), value)
+        residual = (v - value) * inverse_sigma
+        return residual, np.sum(residual ** 2, axis=-1)
+
+    def weighted_jacobian(params):
+        model.differentiate(u, columns(params), jacobian)
+        jacobian[...] *= inverse_sigma[..., np.newaxis]
+        return jacobian
+
+    p0 = np.broadcast_to(np.asarray(p0, dtype=float), (rows, size))
+    params = np.linalg.solve(matrix, ((p0 - offset) / row_scale).T).T
+    residual, chi2 = weighted_residual(params)
+    damping = np.full(rows, 1e-3)
+    active = np.ones(rows, dtype=bool)
+    converged = np.zeros(rows, dtype=bool)
+    iterations = np.zeros(rows, dtype=int)
+    for _ in range(max_iterations):
+        iterations[active] += 1
+        jac = weighted_jacobian(params)
+        hessian = np.einsum('mni,mnj->mij', jac, jac)
+        gradient = np.einsum('mni,mn->mi', jac, residual)
+        diagonal = np.diagonal(hessian, axis1=-2, axis2=-1)
+        diagonal = np.maximum(diagonal, 1e-12 * diagonal.max(-1, keepdims=True)
+                              + np.finfo(float).tiny)
+        damped = hessian + np.eye(size) * (damping[:, np.newaxis]
+                                           * diagonal)[..., np.newaxis]
+        step = np.linalg.solve(damped, gradient[..., np.newaxis])[..., 0]
+        step[~active] = 0.0
+        trial = params + step
+        trial_residual, trial_chi2 = weighted_residual(trial)
+        improved = active & (trial_chi2 < chi2)
+        small_step = np.all(np.abs(step) <= tolerance *
+                            (np.abs(params) + tolerance), axis=-1)
+        small_decrease = chi2 - trial_chi2 <= tolerance * chi2
+        params[improved] = trial[improved]
+        residual[improved] = trial_residual[improved]
+        chi2[improved] = trial_chi2[improved]
+        damping = np.where(improved, damping / 10, damping * 10)
+        stalled = damping > 1e10
+        converged |= active & ((improved & (small_step | small_decrease))
+                               | stalled)
+        active &= ~converged
+        if not np.any(active):
+            break
+
+    jac = weighted_jacobian(params)
+    hessian = np.einsum('mni,mnj->mij', jac, jac)
+    dof = np.maximum(points - size, 1)
+    covariance = np.linalg.pinv(hessian) * (chi2 / dof)[:, np.newaxis,
+                                                          np.newaxis]
+    transform = row_scale[..., np.newaxis] * matrix
+    popt = offset + np.einsum('mij,mj->mi', transform, params)
+    pcov = transform @ covariance @ np.swapaxes(transform, -1, -2)
+    return (popt, pcov, iterations, converged) if full_output else (popt, pcov)
+
+
+def irls_polynomial_fit(x, y, degree=1, sigma_type='huber', mask=None,
+                        coefficients=None, max_cycles=50, tolerance=1e-10,
+                        shift_tolerance=None, full_output=False):
+    """
+    Fit polynomial background of `degree` to `y` by iteratively reweighted
+    least squares. In every cycle, sigma is evaluated for residuals of points
+    in `mask` (by default all) and polynomial is fit to these points exactly.
+    Cycles stop for each row independently once the relative decrease of its
+    mean squared weighted residual of all points drops below `tolerance` or,
+    if `shift_tolerance` is given, once the largest shift of the background
+    between cycles drops below this fraction of the row's range of y instead.
+
+    :param x: Array of shape (n, ) with positions common for all spectra.
+    :param y: Array of shape (n, ) or (m, n) with intensities of spectra.
+    :param degree: Degree of fitted polynomial.
+    :param sigma_type: Name of sigma function in `SIGMA_FUNCTIONS`.
+    :param mask: Boolean array of shape (n, ) selecting points to be fit.
+    :param coefficients: Initial increasing order coefficients; by default,
+        line passing through the first and last point of each row.
+    :param max_cycles: Maximum number of reweighting cycles.
+    :param tolerance: Relative decrease of mean squared error to stop at.
+    :param shift_tolerance: Relative shift of the background to stop at.
+    :param full_output: If True, return also number of cycles for each row.
+    :return: Increasing order coefficients of shape (degree + 1, ) or
+        (m, degree + 1), matching dimensionality of y.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    rows = np.atleast_2d(y)
+    fit_all = mask is None or np.all(mask)
+    mask = slice(None) if fit_all else np.asarray(mask)
+    sigma_function = SIGMA_FUNCTIONS[sigma_type]
+    if coefficients is None:
+        coefficients = chord_coefficients(x, rows, degree)
+    coefficients = np.broadcast_to(coefficients, (len(rows), degree + 1))
+    center, scale = _scaling(x)
+    scaled = substitute_polynomial(coefficients, center, scale)
+    vandermonde = np.vander((x - center) / scale, degree + 1, increasing=True)
+
+    delta = rows - scaled @ vandermonde.T
+    sigma = sigma_function(delta)
+    mse = np.mean((delta / sigma) ** 2, axis=-1)
+    active = np.arange(len(rows))
+    cycles = np.zeros(len(rows), dtype=int)
+    for _ in range(max_cycles):
+        cycles[active] += 1
+        fitted = rows[active][:, mask]
+        fit_sigma = sigma[active] if fit_all \
+            else sigma_function(delta[active][:, mask])
+        scaled[active] = _solve_weighted(vandermonde[mask], fitted,
+                                         fit_sigma ** -2.0)
+        previous_mse = mse[active]
+        previous_delta = delta[active]
+        delta[active] = rows[active] - scaled[active] @ vandermonde.T
+        sigma[active] = sigma_function(delta[active])
+        mse[active] = np.mean((delta[active] / sigma[active]) ** 2, axis=-1)
+        if shift_tolerance is None:
+            converged = previous_mse / mse[active] - 1 < tolerance
+        else:
+            shift = np.max(np.abs(delta[active] - previous_delta), axis=-1)
+            converged = shift <= shift_tolerance * np.ptp(rows[active], -1)
+        active = active[~converged]
+        if len(active) == 0:
+            break
+    coefficients = substitute_polynomial(scaled, -center / scale, 1 / scale)
+    if y.ndim == 1:
+        coefficients, cycles = coefficients[0], cycles[0]
+    return (coefficients, cycles) if full_output else coefficients
+
+
+@lru_cache(maxsize=16)
+def _difference_penalty_bands(n, smoothness):
+    """Return upper banded form of `smoothness` * D.T @ D, where D is
+    the (n - 2, n) second-order difference matrix, for `solveh_banded`"""
+    difference = sparse.diags([1., -2., 1.], [0, 1, 2], shape=(n - 2, n))
+    penalty = (smoothness * (difference.T @ difference)).todia()
+    bands = np.zeros((3, n))
+    for k in range(3):
+        bands[2 - k, k:] = penalty.diagonal(k)
+    bands.flags.writeable = False
+    return bands
+
+
+def arpls_baseline(y, smoothness=1e6, tolerance=1e-3, max_cycles=50):
+    """
+    Estimate smooth baseline of `y` by asymmetrically reweighted penalized
+    least squares (doi:10.1039/C4AN01061B). Each cycle solves pentadiagonal
+    system (W + smoothness * D.T @ D) z = W y in O(n) and reweights points
+    with logistic function of their residuals, based on the statistics
+    of negative residuals only, so that peaks above the baseline are ignored.
+
+    :param y: Array of shape (n, ) or (m, n) with intensities of spectra.
+    :param smoothness: Penalty of second differences of the baseline.
+    :param tolerance: Relative change of weights at which cycles stop.
+    :param max_cycles: Maximum number of reweighting cycles.
+    :return: Baseline array of the same shape as y.
+    """
+    y = np.asarray(y, dtype=float)
+    if y.ndim > 1:
+        return np.vstack([arpls_baseline(row, smoothness, tolerance,
+                                         max_cycles) for row in y])
+    if len(y) < 3:
+        return y.copy()
+    penalty = _difference_penalty_bands(len(y), float(smoothness))
+    bands = np.empty_like(penalty)
+    weights = np.ones_like(y)
+    baseline = y
+    for _ in range(max_cycles):
+        bands[:] = penalty
+        bands[2] += weights
+        baseline = solveh_banded(bands, weights * y, check_finite=False)
+        delta = y - baseline
+        negative = delta[delta < 0]
+        if len(negative) < 2 or negative.std() == 0:
+            break
+        mean, std = negative.mean(), negative.std()
+        new_weights = expit(-2 * (delta - (2 * std - mean)) / std)
+        change = np.linalg.norm(weights - new_weights) / \
+            np.linalg.norm(weights)
+        weights = new_weights
+        if change < tolerance:
+            break
+    return baseline
@@ -1,8 +1,71 @@
 import numpy as np
+import uncertainties
+from uncertainties import nominal_value, UFloat
+from .models import FWHM_PER_SIGMA
+
+
+class Polynomial:
+    """
+    Polynomial with `coefficients` of increasing order evaluated using
+    Horner scheme on floats and arrays. If x or any coefficient is a `UFloat`,
+    the value is computed for nominal values and its uncertainty is propagated
+    to first order using the derivatives with respect to x and coefficients,
+    which keeps correlations while adding a single node to uncertainty graph.
+    """
+    __slots__ = ('coefficients', '_nominal', '_derivative', '_wrapped')
+
+    def __init__(self, *coefficients):
+        self.coefficients = coefficients if coefficients else (0.0, )
+        self._nominal = tuple(nominal_value(c) for c in self.coefficients)
+        self._derivative = None
+        self._wrapped = None
+
+    def __len__(self):
+        return len(self.coefficients)
+
+    def __repr__(self):
+        return f'Polynomial{self.coefficients!r}'
+
+    @property
+    def degree(self) -> int:
+        return len(self) - 1
+
+    @property
+    def derivative(self) -> 'Polynomial':
+        """Cached first derivative of the polynomial"""
+        if self._derivative is None:
+            self._derivative = Polynomial(*[i * c for i, c in enumerate(
+                self.coefficients) if i > 0])
+        return self._derivative
+
+    @staticmethod
+    def _horner(x, coefficients):
+        result = coefficients[-1] + 0 * x
+        for c in coefficients[-2::-1]:
+            result = result * x + c
+        return result
+
+    def _create_wrapped(self):
+        """Wrap evaluation of self at (x, *coefficients) with derivatives"""
+        nominal_derivative = self.derivative._nominal
+        derivatives = [lambda x, *_: self._horner(x, nominal_derivative)] + \
+                      [lambda x, *_, i=i: x ** i for i in range(len(self))]
+        return uncertainties.wrap(lambda x, *c: self._horner(x, c),
+                                  derivatives)
+
+    def __call__(self, x):
+        if isinstance(x, UFloat) or any(isinstance(c, UFloat)
+                                        for c in self.coefficients):
+            if isinstance(x, np.ndarray):
+                return np.array([self(v) for v in x.flat]).reshape(x.shape)
+            if self._wrapped is None:
+                self._wrapped = self._create_wrapped()
+            return self._wrapped(x, *self.coefficients)
+        return self._horner(x, self._nominal)
 
 
 def polynomial(*coefficients):
-    return lambda x: sum([c * x ** i for i, c in enumerate(coefficients)])
+    return Polynomial(*coefficients)
 
 
 def gaussian(a, mu, si):
@@ -14,7 +77,7 @@ def lorentzian(a, mu, ga):
 
 
 def pseudovoigt(a, mu, w, et):
-    si = w / (np.sqrt(8 * np.log(2)))
+    si = w / FWHM_PER_SIGMA
     ga = w / 2
     return lambda x: et * gaussian(a, mu, si)(x) + \
                      (1 - et) * lorentzian(a, mu, ga)(x)
@@ -0,0 +1,115 @@
+"""
+Optional backend of fused kernels for the hot loops of fitting. If numba
+is installed, kernels below are compiled and evaluate every point in a single
+pass; otherwise, or if environment variable `PRUBY_KERNELS` is 'numpy',
+`backend` falls back to NumPy and models use their own in-place evaluation.
+Kernels of `KernelBackend` set to None are unavailable in a given backend.
+"""
+
+import math
+import os
+from typing import Callable, NamedTuple
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def huber_sigma_numpy(delta, out):
+    """Write Huber sigma of residuals `delta` into `out`"""
+    np.abs(delta, out=out)
+    tol = 0.01 * out.max()
+    np.multiply(delta, 2, out=out)
+    out -= tol
+    out *= tol
+    out[delta < tol] = tol ** 2
+    return out
+
+
+def huber_sigma_loop(delta, out):
+    """Write Huber sigma of residuals `delta` into `out` in two loops"""
+    maximum = 0.0
+    for i in range(delta.shape[0]):
+        if abs(delta[i]) > maximum:
+            maximum = abs(delta[i])
+    tol = 0.01 * maximum
+    for i in range(delta.shape[0]):
+        if delta[i] < tol:
+            out[i] = tol * tol
+        else:
+            out[i] = tol * (2 * delta[i] - tol)
+    return out
+
+
+def two_gaussians_loop(x, y, params, out, residual):
+    """Write sum of two gaussians at `x` or, if `residual`, `y` minus it,
+    into `out`; `params` are (a1, mu1, si1, a2, mu2, si2)"""
+    a1, mu1, si1, a2, mu2, si2 = params[0], params[1], params[2], \
+        params[3], params[4], params[5]
+    c1 = -0.5 / si1 ** 2
+    c2 = -0.5 / si2 ** 2
+    for i in range(x.shape[0]):
+        d1 = x[i] - mu1
+        d2 = x[i] - mu2
+        f = math.exp(d1 * d1 * c1) * a1 + math.exp(d2 * d2 * c2) * a2
+        out[i] = y[i] - f if residual else f
+    return out
+
+
+def two_pseudovoigts_loop(x, y, params, out, residual):
+    """Write sum of two pseudo-voigts at `x` or, if `residual`, `y` minus it,
+    into `out`; `params` are (a1, mu1, w1, et1, a2, mu2, w2, et2)"""
+    fwhm_per_sigma = math.sqrt(8 * math.log(2))
+    a1, mu1, w1, et1, a2, mu2, w2, et2 = params[0], params[1], params[2], \
+        params[3], params[4], params[5], params[6], params[7]
+    c1 = -0.5 / (w1 / fwhm_per_sigma) ** 2
+    c2 = -0.5 / (w2 / fwhm_per_sigma) ** 2
+    ga1 = (w1 / 2) ** 2
+    ga2 = (w2 / 2) ** 2
+    for i in range(x.shape[0]):
+        d1 = (x[i] - mu1) ** 2
+        d2 = (x[i] - mu2) ** 2
+        f1 = math.exp(d1 * c1) * a1 * et1 + a1 * ga1 / (d1 + ga1) * (1 - et1)
+        f2 = math.exp(d2 * c2) * a2 * et2 + a2 * ga2 / (d2 + ga2) * (1 - et2)
+        f = f1 + f2
+        out[i] = y[i] - f if residual else f
+    return out
+
+
+class KernelBackend(NamedTuple):
+    name: str
+    huber_sigma: Callable
+    two_gaussians: Callable = None
+    two_pseudovoigts: Callable = None
+
+
+NUMPY_BACKEND = KernelBackend('numpy', huber_sigma_numpy)
+
+
+def compile_numba_backend() -> KernelBackend:
+    jit = numba.njit(cache=True)
+    return KernelBackend('numba', huber_sigma=jit(huber_sigma_loop),
+                         two_gaussians=jit(two_gaussians_loop),
+                         two_pseudovoigts=jit(two_pseudovoigts_loop))
+
+
+def set_backend(name: str = '') -> KernelBackend:
+    """Select kernel backend 'numpy' or 'numba'; by default the fastest one"""
+    global backend
+    if not name:
+        name = 'numpy' if numba is None else 'numba'
+    if name == 'numpy':
+        backend = NUMPY_BACKEND
+    elif name == 'numba':
+        if numba is None:
+            raise ImportError('Kernel backend "numba" requires numba package')
+        backend = compile_numba_backend()
+    else:
+        raise KeyError(f'Unknown kernel backend "{name}"')
+    return backend
+
+
+backend: KernelBackend = NUMPY_BACKEND
+set_backend(os.environ.get('PRUBY_KERNELS', ''))
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def xmin(obj):
     try:
         return min(obj)
@@ -12,7 +15,15 @@ def xmax(obj):
         return obj
 
 
+def nominal(obj):
+    return getattr(obj, 'nominal_value', obj)
+
+
 class LineSubset:
+    """
+    Immutable and hashable union of closed segments on a real line, stored
+    as a sorted (n, 2) array of `bounds` of disjoint and non-touching segments.
+    """
 
     # SEGMENT METHODS
     class LineSegment:
@@ -39,44 +50,76 @@ class LineSubset:
             return all((xmin(self) <= xmin(item), xmax(self) >= xmax(item)))
 
     # CREATION METHODS
+    __slots__ = ('_bounds', )
+
     def __init__(self, left=None, right=None):
-        self.segments = []
         if left is None and right is None:
-            pass
+            bounds = np.empty((0, 2))
         elif right is None:
-            for left1, left2 in left:
-                self.segments.append(self.LineSegment(left1, left2))
+            bounds = np.array([tuple(map(nominal, pair)) for pair in left],
+                              dtype=float)
+            bounds = bounds.reshape(-1, 2)
         else:
-            self.segments.append(self.LineSegment(left, right))
-        self.segments = self._merge(self.segments)
-
-    def _merge(self, segments):
-        limits = sorted(list(zip(list(self), ['l', 'r'] * len(self.segments))))
-        segments = []
-        while limits:
-            left = limits.pop(0)[0]
-            depth = 1
-            while limits:
-                lim = limits.pop(0)
-                if lim[1] == 'l':
-                    depth += 1
-                elif lim[1] == 'r' and depth > 1:
-                    depth -= 1
-                else:
-                    segments.append(self.LineSegment(left, lim[0]))
-                    break
-        return segments
+            bounds = np.array([[nominal(left), nominal(right)]], dtype=float)
+        incorrect = bounds[:, 0] > bounds[:, 1]
+        if np.any(incorrect):
+            left, right = bounds[np.argmax(incorrect)]
+            raise ValueError('Left ({}) > Right ({})'.format(left, right))
+        self._set_bounds(self._merge(bounds))
+
+    @classmethod
+    def _from_bounds(cls, bounds):
+        """Create subset from already sorted and merged (n, 2) `bounds`"""
+        new = cls.__new__(cls)
+        new._set_bounds(bounds)
+        return new
+
+    def _set_bounds(self, bounds):
+        bounds = bounds + 0.0  # copy, also normalizing -0.0 for hashing
+        bounds.flags.writeable = False
+        object.__setattr__(self, '_bounds', bounds)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+    def __reduce__(self):
+        return self.__class__, (self._bounds.tolist(), )
+
+    @staticmethod
+    def _merge(bounds):
+        """Sort (n, 2) `bounds` and join overlapping or touching segments"""
+        if len(bounds) < 2:
+            return bounds
+        bounds = bounds[np.lexsort((bounds[:, 1], bounds[:, 0]))]
+        reach = np.maximum.accumulate(bounds[:, 1])
+        starts = np.flatnonzero(np.r_[True, bounds[1:, 0] > reach[:-1]])
+        return np.column_stack([bounds[starts, 0],
+                                np.maximum.reduceat(bounds[:, 1], starts)])
+
+    @property
+    def bounds(self):
+        """Read-only (n, 2) array of sorted, disjoint segments' bounds"""
+        return self._bounds
+
+    @property
+    def segments(self):
+        return [self.LineSegment(left, right)
+                for left, right in self._bounds.tolist()]
 
     # COMPARISON METHODS
     def __eq__(self, other):
-        return self.segments == other.segments
+        if not isinstance(other, LineSubset):
+            return NotImplemented
+        return np.array_equal(self._bounds, other._bounds)
 
     def __ne__(self, other):
         return not(self == other)
 
+    def __hash__(self):
+        return hash(self._bounds.tobytes())
+
     def __lt__(self, other):
-        return all(any(s in o for o in other.segments) for s in self.segments) \
-               and not(self == other)
+        return self._is_covered_by(other) and not(self == other)
 
     def __gt__(self, other):
         return other < self
@@ -87,27 +130,50 @@ class LineSubset:
     def __ge__(self, other):
         return other < self or self == other
 
+    def _is_covered_by(self, other):
+        """True if every segment of self lies within a segment of other"""
+        if len(self._bounds) == 0:
+            return True
+        if len(other._bounds) == 0:
+            return False
+        indices = np.searchsorted(other._bounds[:, 0], self._bounds[:, 0],
+                                  side='right') - 1
+        covering = other._bounds[np.maximum(indices, 0), 1]
+        return bool(np.all((indices >= 0) & (covering >= self._bounds[:, 1])))
+
     # UNARY OPERATIONS
     def __pos__(self):
         return self
 
     def __neg__(self):
-        limits = [-float('inf')] + list(self) + [float('inf')]
-        lefts = limits[0::2]
-        rights = limits[1::2]
-        segments = [(lef, rig) for lef, rig in zip(lefts, rights) if lef < rig]
-        return self.__class__(segments)
+        lefts = np.r_[-np.inf, self._bounds[:, 1]]
+        rights = np.r_[self._bounds[:, 0], np.inf]
+        gaps = np.column_stack([lefts, rights])[lefts < rights]
+        return self._from_bounds(self._merge(gaps))
 
     # ARITHMETIC METHODS
     def __add__(self, other):
-        segments = self.segments + other.segments
-        return self.__class__(segments)
+        bounds = np.concatenate([self._bounds, other._bounds])
+        return self._from_bounds(self._merge(bounds))
 
     def __sub__(self, other):
         return self * -other
 
     def __mul__(self, other):
-        return -(-self + -other)
+        """Intersection, consisting of overlaps of non-zero length"""
+        a, b = self._bounds, other._bounds
+        i = j = 0
+        overlaps = []
+        while i < len(a) and j < len(b):
+            left = max(a[i, 0], b[j, 0])
+            right = min(a[i, 1], b[j, 1])
+            if left < right:
+                overlaps.append((left, right))
+            if a[i, 1] < b[j, 1]:
+                i += 1
+            else:
+                j += 1
+        return self._from_bounds(np.array(overlaps).reshape(-1, 2))
 
     def __truediv__(self, other):
         return (self - other) + (other - self)
@@ -117,13 +183,21 @@ class LineSubset:
         return ' + '.join([str(s) for s in self.segments])
 
     def __repr__(self):
-        zipped = zip(list(self)[0::2], list(self)[1::2])
-        pairs = ['{}, {}'.format(l, r) for l, r in zipped]
+        pairs = ['{}, {}'.format(l, r) for l, r in self._bounds.tolist()]
         return 'LineSubset({})'.format('; '.join(pairs))
 
     # CONTAINER METHODS
     def __iter__(self):
-        return iter([lim for pair in self.segments for lim in pair])
+        return iter(self._bounds.ravel().tolist())
 
     def __contains__(self, item):
         return any(item in segment for segment in self.segments)
+
+    def mask(self, values):
+        """Return a boolean array marking which of `values` are in subset"""
+        values = np.asarray(values)
+        if len(self._bounds) == 0:
+            return np.zeros(values.shape, dtype=bool)
+        lefts, rights = self._bounds[:, 0], self._bounds[:, 1]
+        indices = np.searchsorted(lefts, values, side='right') - 1
+        return (indices >= 0) & (values <= rights[np.maximum(indices, 0)])
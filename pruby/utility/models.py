@@ -0,0 +1,279 @@
+import abc
+from typing import NamedTuple, Tuple
+import numpy as np
+from . import kernels
+
+
+FWHM_PER_SIGMA = np.sqrt(8 * np.log(2))
+
+
+class Parameter(NamedTuple):
+    """Name and kind of model parameter; kind is one of 'amplitude',
+    'position', 'width', 'shape' or 'coefficient' of x to the `power`"""
+    name: str
+    kind: str
+    power: int = 0
+
+
+class Model(abc.ABC):
+    """
+    Reusable model function `model(x, *params)` with its analytic
+    `jacobian(x, *params)` and `parameters` metadata. Values are evaluated
+    in-place into buffers preallocated for the last shape of x, so that
+    repeated calls during a fit do not allocate new arrays. Parameters may
+    also be arrays broadcastable against x, e.g. columns of shape (m, 1)
+    for x of shape (m, n), to evaluate m independent models at once.
+    The returned arrays are overwritten by subsequent calls and must be copied
+    if they are to be kept; for the same reason a single model should not be
+    shared between threads.
+    """
+    parameters: Tuple[Parameter, ...] = ()
+
+    def __init__(self):
+        self._buffers = {}
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def __add__(self, other):
+        return SumModel(self, other)
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(p.name for p in self.parameters)
+
+    @property
+    def kinds(self) -> Tuple[str, ...]:
+        return tuple(p.kind for p in self.parameters)
+
+    def _buffer(self, name, shape):
+        """Return a preallocated float array of `shape` reserved for `name`,
+        reallocated only when a different shape is requested for it"""
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[name] = np.empty(shape)
+        return buffer
+
+    @abc.abstractmethod
+    def evaluate(self, x, params, out):
+        """Write value of model at `x` for `params` into `out`"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def differentiate(self, x, params, out):
+        """Write derivatives of model at `x` with respect to every one
+        of `params` into subsequent columns of `out` of shape
+        (len(x), len(self))"""
+        raise NotImplementedError
+
+    def residual(self, x, y, *params, out=None):
+        """Return `y` minus model at `x`, written into `out` if given"""
+        x = np.asarray(x, dtype=float)
+        out = self._buffer('residual', x.shape) if out is None else out
+        self.evaluate(x, params, out)
+        np.subtract(y, out, out=out)
+        return out
+
+    def __call__(self, x, *params):
+        x = np.asarray(x, dtype=float)
+        out = self._buffer('value', x.shape)
+        self.evaluate(x, params, out)
+        return out if out.ndim else out[()]
+
+    def jacobian(self, x, *params):
+        x = np.asarray(x, dtype=float)
+        out = self._buffer('jacobian', x.shape + (len(self), ))
+        self.differentiate(x, params, out)
+        return out
+
+
+class PolynomialModel(Model):
+    """Polynomial of given `degree` with coefficients of increasing order"""
+    def __init__(self, degree: int = 1):
+        super().__init__()
+        self.parameters = tuple(Parameter(f'a{i}', 'coefficient', i)
+                                for i in range(degree + 1))
+
+    def evaluate(self, x, params, out):
+        out[...] = params[-1]
+        for coefficient in params[-2::-1]:
+            out *= x
+            out += coefficient
+
+    def differentiate(self, x, params, out):
+        out[..., 0] = 1.0
+        for i in range(1, len(self)):
+            np.multiply(out[..., i - 1], x, out=out[..., i])
+
+
+class GaussianModel(Model):
+    """Gaussian a * exp(-(x - mu)^2 / (2 * si^2))"""
+    parameters = (Parameter('a', 'amplitude'), Parameter('mu', 'position'),
+                  Parameter('si', 'width'))
+
+    def evaluate(self, x, params, out):
+        a, mu, si = params
+        np.subtract(x, mu, out=out)
+        np.square(out, out=out)
+        out *= -0.5 / si ** 2
+        np.exp(out, out=out)
+        out *= a
+
+    def differentiate(self, x, params, out):
+        a, mu, si = params
+        d = self._buffer('distance', x.shape)
+        np.subtract(x, mu, out=d)
+        np.square(d, out=out[..., 0])
+        out[..., 0] *= -0.5 / si ** 2
+        np.exp(out[..., 0], out=out[..., 0])
+        np.multiply(out[..., 0], d, out=out[..., 1])
+        out[..., 1] *= a / si ** 2
+        np.multiply(out[..., 1], d, out=out[..., 2])
+        out[..., 2] *= 1 / si
+
+
+class LorentzianModel(Model):
+    """Lorentzian a * ga^2 / ((x - mu)^2 + ga^2)"""
+    parameters = (Parameter('a', 'amplitude'), Parameter('mu', 'position'),
+                  Parameter('ga', 'width'))
+
+    def evaluate(self, x, params, out):
+        a, mu, ga = params
+        np.subtract(x, mu, out=out)
+        np.square(out, out=out)
+        out += ga ** 2
+        np.divide(a * ga ** 2, out, out=out)
+
+    def differentiate(self, x, params, out):
+        a, mu, ga = params
+        d = self._buffer('distance', x.shape)
+        np.subtract(x, mu, out=d)
+        np.square(d, out=out[..., 0])
+        out[..., 0] += ga ** 2
+        np.divide(ga ** 2, out[..., 0], out=out[..., 0])
+        np.square(out[..., 0], out=out[..., 1])
+        out[..., 1] *= d
+        out[..., 1] *= 2 * a / ga ** 2
+        np.multiply(out[..., 1], d, out=out[..., 2])
+        out[..., 2] *= 1 / ga
+
+
+class PseudovoigtModel(Model):
+    """Mixture et * gaussian + (1 - et) * lorentzian of common
+    amplitude a, position mu and full width at half maximum w"""
+    parameters = (Parameter('a', 'amplitude'), Parameter('mu', 'position'),
+                  Parameter('w', 'width'), Parameter('et', 'shape'))
+
+    def __init__(self):
+        super().__init__()
+        self.gaussian = GaussianModel()
+        self.lorentzian = LorentzianModel()
+
+    def evaluate(self, x, params, out):
+        a, mu, w, et = params
+        term = self._buffer('term', x.shape)
+        self.gaussian.evaluate(x, (a, mu, w / FWHM_PER_SIGMA), out)
+        out *= et
+        self.lorentzian.evaluate(x, (a, mu, w / 2), term)
+        term *= 1 - et
+        out += term
+
+    def differentiate(self, x, params, out):
+        a, mu, w, et = params
+        g = self._buffer('gaussian', x.shape + (3, ))
+        lo = self._buffer('lorentzian', x.shape + (3, ))
+        self.gaussian.differentiate(x, (a, mu, w / FWHM_PER_SIGMA), g)
+        self.lorentzian.differentiate(x, (a, mu, w / 2), lo)
+        np.subtract(g[..., 0], lo[..., 0], out=out[..., 3])
+        out[..., 3] *= a
+        et = np.asarray(et)[..., np.newaxis]
+        g *= et
+        lo *= 1 - et
+        np.add(g[..., :2], lo[..., :2], out=out[..., :2])
+        g[..., 2] *= 1 / FWHM_PER_SIGMA
+        lo[..., 2] *= 1 / 2
+        np.add(g[..., 2], lo[..., 2], out=out[..., 2])
+
+
+class SumModel(Model):
+    """Sum of `models`, whose parameters are concatenated in order
+    and whose names are suffixed with the index of model, counted from 1.
+    Sums of two gaussians or pseudo-voigts use fused `kernels` if available."""
+    fused_kernels = {(GaussianModel, GaussianModel): 'two_gaussians',
+                     (PseudovoigtModel, PseudovoigtModel): 'two_pseudovoigts'}
+
+    def __init__(self, *models: Model):
+        super().__init__()
+        self.models = models
+        self.parameters = tuple(
+            Parameter(f'{p.name}{i}', p.kind, p.power)
+            for i, model in enumerate(models, 1) for p in model.parameters)
+        self._kernel_name = self.fused_kernels.get(tuple(map(type, models)))
+
+    @property
+    def _kernel(self):
+        return getattr(kernels.backend, self._kernel_name) \
+            if self._kernel_name else None
+
+    def _split(self, params):
+        start = 0
+        for model in self.models:
+            yield model, params[start:start + len(model)], \
+                  slice(start, start + len(model))
+            start += len(model)
+
+    def evaluate(self, x, params, out):
+        if self._kernel is not None and x.ndim == 1:
+            self._kernel(x, x, np.asarray(params, dtype=float), out, False)
+            return
+        term = self._buffer('term', x.shape)
+        for i, (model, model_params, _) in enumerate(self._split(params)):
+            model.evaluate(x, model_params, out if i == 0 else term)
+            if i > 0:
+                out += term
+
+    def residual(self, x, y, *params, out=None):
+        x = np.asarray(x, dtype=float)
+        if self._kernel is None or x.ndim != 1:
+            return super().residual(x, y, *params, out=out)
+        out = self._buffer('residual', x.shape) if out is None else out
+        self._kernel(x, np.asarray(y, dtype=float),
+                     np.asarray(params, dtype=float), out, True)
+        return out
+
+    def differentiate(self, x, params, out):
+        for model, model_params, columns in self._split(params):
+            model.differentiate(x, model_params, out[..., columns])
+
+
+class CamelModel(Model):
+    """Two gaussians with a third, broad gaussian centered between them"""
+    parameters = (Parameter('a1', 'amplitude'), Parameter('mu1', 'position'),
+                  Parameter('si1', 'width'), Parameter('a2', 'amplitude'),
+                  Parameter('mu2', 'position'), Parameter('si2', 'width'),
+                  Parameter('a', 'amplitude'), Parameter('si', 'width'))
+
+    def __init__(self):
+        super().__init__()
+        self.gaussian = GaussianModel()
+
+    def evaluate(self, x, params, out):
+        a1, mu1, si1, a2, mu2, si2, a, si = params
+        term = self._buffer('term', x.shape)
+        self.gaussian.evaluate(x, (a2, mu2, si2), out)
+        self.gaussian.evaluate(x, (a1, mu1, si1), term)
+        out += term
+        self.gaussian.evaluate(x, (a, (mu2 + mu1) / 2, si), term)
+        out += term
+
+    def differentiate(self, x, params, out):
+        a1, mu1, si1, a2, mu2, si2, a, si = params
+        hump = self._buffer('hump', x.shape + (3, ))
+        self.gaussian.differentiate(x, (a1, mu1, si1), out[..., 0:3])
+        self.gaussian.differentiate(x, (a2, mu2, si2), out[..., 3:6])
+        self.gaussian.differentiate(x, (a, (mu2 + mu1) / 2, si), hump)
+        hump[..., 1] *= 0.5
+        out[..., 1] += hump[..., 1]
+        out[..., 4] += hump[..., 1]
+        out[..., 6] = hump[..., 0]
+        out[..., 7] = hump[..., 2]
@@ -1,14 +1,35 @@
+import bz2
+import gzip
+import lzma
 import pathlib
 import tempfile
 import unittest
+from unittest import mock
+import numpy as np
 from pruby.engine import Engine
 from pruby import PressureCalculator
 from pruby import strategies
+from pruby.spectrum import SpectrumStack
+from pruby.utility import LineSubset, SpectrumCache
 
 
 test_data1_path = str(pathlib.Path(__file__).parent.joinpath('test_data1.txt'))
 test_data2_path = str(pathlib.Path(__file__).parent.joinpath('test_data2.txt'))
 
+
+temp_cache_dir = tempfile.TemporaryDirectory()
+default_cache = strategies.ReadingStrategies.cache
+
+
+def setUpModule():
+    strategies.ReadingStrategies.cache = \
+        SpectrumCache(directory=temp_cache_dir.name)
+
+
+def tearDownModule():
+    strategies.ReadingStrategies.cache = default_cache
+    temp_cache_dir.cleanup()
+
 subengines = \
     [
         'reader',
@@ -133,6 +154,17 @@ class TestCalculator(unittest.TestCase):
         calc.read(test_data2_path)
         self.assertGreater(calc.r1.n, 694.0)
 
+    def test_float32_storage_keeps_r1_precision(self):
+        calc64, calc32 = PressureCalculator(), PressureCalculator()
+        calc64.read(test_data1_path)
+        calc32.dat_path = test_data1_path
+        calc32.engine.read()
+        calc32.raw_spectrum = calc32.raw_spectrum.copy(dtype=np.float32)
+        calc32.engine.backfit()
+        calc32.engine.peakfit()
+        self.assertEqual(calc32.peak_spectrum.y.dtype, np.float32)
+        self.assertAlmostEqual(calc64.r1.n, calc32.r1.n, delta=calc64.r1.s / 10)
+
     def test_different_fitters_give_different_r1(self):
         calc1 = PressureCalculator()
         calc2 = PressureCalculator()
@@ -150,6 +182,84 @@ class TestCalculator(unittest.TestCase):
         self.assertNotAlmostEqual(calc1.r1.n, calc3.r1.n)
         self.assertNotAlmostEqual(calc2.r1.n, calc3.r1.n)
 
+    def test_arpls_background_agrees_with_linear_huber(self):
+        calc1, calc2 = PressureCalculator(), PressureCalculator()
+        calc2.engine.set_strategy(backfitting='arPLS')
+        calc1.read(test_data2_path)
+        calc2.read(test_data2_path)
+        self.assertAlmostEqual(calc1.r1.n, calc2.r1.n, delta=0.01)
+        self.assertTrue(np.all(calc2.back_spectrum.y <= calc2.raw_spectrum.y
+                               + 3 * np.std(calc2.peak_spectrum.y[:50])))
+
+    def test_fast_and_cwt_peak_finders_agree(self):
+        calc1, calc2 = PressureCalculator(), PressureCalculator()
+        calc2.engine.peakfitter.peak_finder = 'cwt'
+        calc1.read(test_data1_path)
+        calc2.read(test_data1_path)
+        fitter1, fitter2 = calc1.engine.peakfitter, calc2.engine.peakfitter
+        peaks1 = fitter1.find_initial_peaks(calc1.peak_spectrum)
+        peaks2 = fitter2.find_initial_peaks(calc2.peak_spectrum)
+        self.assertAlmostEqual(peaks1[0], peaks2[0], delta=0.1)
+        self.assertAlmostEqual(peaks1[2], peaks2[2], delta=0.1)
+        self.assertAlmostEqual(calc1.r1.n, calc2.r1.n, delta=0.01)
+        fitter1.peak_finder = 'dummy'
+        with self.assertRaises(KeyError):
+            fitter1.find_initial_peaks(calc1.peak_spectrum)
+
+    def assert_peak_finder_results(self, peak_finder, expected):
+        for (path, peakfitting), (r1, r1_s, p) in expected.items():
+            calc = PressureCalculator()
+            calc.engine.set_strategy(peakfitting=peakfitting)
+            calc.engine.peakfitter.peak_finder = peak_finder
+            calc.read(path)
+            calc.calculate_p_from_r1()
+            self.assertAlmostEqual(calc.r1.n, r1, delta=1e-5)
+            self.assertAlmostEqual(calc.r1.s, r1_s, delta=1e-5)
+            self.assertAlmostEqual(calc.p.n, p, delta=0.005)
+
+    def test_fast_peak_finder_results(self):
+        self.assert_peak_finder_results('fast', {
+            (test_data1_path, 'Gaussian'): (694.81269, 0.00176, 1.556),
+            (test_data2_path, 'Pseudovoigt'): (695.37721, 0.00252, 3.097),
+            (test_data2_path, 'Camel'): (695.38179, 0.00270, 3.110)})
+
+    def test_cwt_peak_finder_results(self):
+        self.assert_peak_finder_results('cwt', {
+            (test_data1_path, 'Gaussian'): (694.81361, 0.00399, 1.558),
+            (test_data2_path, 'Pseudovoigt'): (695.37372, 0.00163, 3.088),
+            (test_data2_path, 'Camel'): (695.41267, 0.00492, 3.195)})
+
+    def test_stack_peakfit_matches_single_peakfits(self):
+        calc = PressureCalculator()
+        calc.read(test_data1_path)
+        x = calc.raw_spectrum.x
+        stack = SpectrumStack(x, [np.interp(x - s, x, calc.raw_spectrum.y)
+                                  for s in (0.0, 0.2, -0.3)])
+        stack = stack.subtract_polynomial(stack.fit_polynomial())
+        positions, covariance = calc.engine.peakfitter.peakfit_stack(stack)
+        self.assertEqual(covariance.shape, (3, 2, 2))
+        for spectrum, (r1, r2), cov in zip(stack, positions, covariance):
+            calc.raw_spectrum = spectrum
+            calc.engine.backfit()
+            calc.engine.peakfit()
+            self.assertAlmostEqual(calc.r1.n, r1, places=6)
+            self.assertAlmostEqual(calc.r2.n, r2, places=6)
+            self.assertAlmostEqual(calc.r1.s, np.sqrt(cov[0, 0]), places=6)
+
+    def test_joint_fit_agrees_with_separate_fits(self):
+        calc1, calc2 = PressureCalculator(), PressureCalculator()
+        calc2.engine.set_strategy(backfitting='No background fitting',
+                                  peakfitting='Joint Pseudovoigt')
+        calc1.engine.set_strategy(peakfitting='Pseudovoigt')
+        calc1.read(test_data1_path)
+        calc2.read(test_data1_path)
+        self.assertAlmostEqual(calc1.r1.n, calc2.r1.n, delta=0.01)
+        self.assertAlmostEqual(calc1.r2.n, calc2.r2.n, delta=0.01)
+        self.assertGreater(np.max(calc2.back_spectrum.y), 0)
+        np.testing.assert_allclose(calc2.back_spectrum.y
+                                   + calc2.peak_spectrum.y,
+                                   calc2.raw_spectrum.y)
+
     def test_different_correctors_translators_give_different_p(self):
         calc1 = PressureCalculator()
         calc2 = PressureCalculator()
@@ -186,5 +296,208 @@ class TestCalculator(unittest.TestCase):
                 self.assertTrue(pathlib.Path(png_path).is_file())
 
 
+class TestReadingStrategies(unittest.TestCase):
+    meta_reader = strategies.MetaTxtReadingStrategy
+
+    def test_meta_vectorized_equals_tolerant(self):
+        with open(test_data2_path, 'r') as file:
+            lines = file.read().splitlines()
+        x1, y1 = self.meta_reader._read_vectorized(lines)
+        x2, y2 = self.meta_reader._read_tolerantly(lines)
+        self.assertEqual(len(x1), 3648)
+        self.assertTrue(np.array_equal(x1, x2))
+        self.assertTrue(np.array_equal(y1, y2))
+
+    def test_meta_limits_applied_while_parsing(self):
+        with open(test_data2_path, 'r') as file:
+            lines = file.read().splitlines()
+        limits = PressureCalculator().limits
+        x1, y1 = self.meta_reader._read_vectorized(lines, limits)
+        x2, y2 = self.meta_reader._read_vectorized(lines)
+        in_limits = [x in limits for x in x2]
+        self.assertTrue(np.array_equal(x1, x2[in_limits]))
+        self.assertTrue(np.array_equal(y1, y2[in_limits]))
+
+    def test_crop_stops_after_right_edge_of_sorted_x(self):
+        def chunks():
+            yield np.array([1.0, 2.0]), np.array([1.0, 2.0])
+            yield np.array([3.0, 4.0]), np.array([3.0, 4.0])
+            raise AssertionError('Parsed chunk past the right edge')
+        x, y = self.meta_reader._crop_chunks(chunks(), LineSubset(1.5, 3.5))
+        self.assertEqual(list(x), [2.0, 3.0])
+
+    def test_single_value_reading(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = pathlib.Path(temp_dir).joinpath('single.txt')
+            path.write_text('694.5(1) 100\n')
+            calc = PressureCalculator()
+            calc.engine.set_strategy(reading='Single value txt',
+                                     backfitting='No background fitting',
+                                     peakfitting='No peak fitting')
+            calc.read(str(path))
+            calc.calculate_p_from_r1()
+        self.assertAlmostEqual(calc.r1.n, 694.5)
+        self.assertAlmostEqual(calc.r1.s, 0.1)
+        self.assertAlmostEqual(calc.p.n, 0.71, places=2)
+
+    def test_raw_reading_of_chunk_multiple_with_blank_end(self):
+        reader = strategies.RawTxtReadingStrategy
+        rows = reader.chunk_size * 2
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = pathlib.Path(temp_dir).joinpath('raw.txt')
+            path.write_text(''.join(f'{690 + i / rows} {i}\n'
+                                    for i in range(rows)) + '\n')
+            x, y = reader._parse(str(path))
+        self.assertEqual(len(x), rows)
+        self.assertEqual(y[-1], rows - 1)
+
+    def test_reading_compressed_files(self):
+        calc = PressureCalculator()
+        calc.read(test_data2_path)
+        with open(test_data2_path, 'rb') as file:
+            contents = file.read()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for module in (gzip, bz2, lzma):
+                path = pathlib.Path(temp_dir).joinpath(module.__name__)
+                path.write_bytes(module.compress(contents))
+                compressed_calc = PressureCalculator()
+                compressed_calc.dat_path = str(path)
+                compressed_calc.engine.reader.read(compressed_calc)
+                self.assertTrue(np.array_equal(calc.raw_spectrum.y,
+                                               compressed_calc.raw_spectrum.y))
+
+    def test_meta_skips_malformed_lines(self):
+        lines = ['header', '1.0 2.0', 'broken line', '3.0 4.0 5.0', 'footer']
+        x, y = self.meta_reader._read_vectorized(lines)
+        self.assertEqual(list(x), [1.0, 3.0])
+        self.assertEqual(list(y), [2.0, 4.0])
+
+
+class TestSeriesReading(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        data = np.loadtxt(test_data1_path)
+        self.x, self.y = data[:, 0], data[:, 1]
+        self.ys = [self.y, self.y * 2.0, self.y + 100.0]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_column_series(self):
+        path = pathlib.Path(self.temp_dir.name).joinpath('columns.txt')
+        with open(path, 'w') as file:
+            file.write('Kinetic series\nFrames: 3\n')
+            np.savetxt(file, np.column_stack([self.x] + self.ys))
+        return str(path)
+
+    def write_section_series(self):
+        path = pathlib.Path(self.temp_dir.name).joinpath('sections.txt')
+        with open(path, 'w') as file:
+            for i, y in enumerate(self.ys):
+                file.write(f'>>>>>Begin Frame {i}<<<<<\n')
+                np.savetxt(file, np.column_stack([self.x, y]))
+        return str(path)
+
+    def test_column_series_frames(self):
+        calc = PressureCalculator()
+        calc.dat_path = self.write_column_series()
+        reader = strategies.ColumnSeriesReadingStrategy()
+        with mock.patch.object(strategies.reading, 'open_text',
+                               wraps=strategies.reading.open_text) as opener:
+            frames = list(reader.frames(calc))
+        opener.assert_called_once()
+        self.assertEqual(len(frames), 3)
+        for frame, y in zip(frames, self.ys):
+            self.assertTrue(np.allclose(frame.y, y[np.isin(self.x, frame.x)]))
+
+    def test_section_series_frames(self):
+        calc = PressureCalculator()
+        calc.dat_path = self.write_section_series()
+        frames = list(strategies.SectionSeriesReadingStrategy().frames(calc))
+        self.assertEqual(len(frames), 3)
+        for frame, y in zip(frames, self.ys):
+            self.assertTrue(np.allclose(frame.y, y[np.isin(self.x, frame.x)]))
+
+    def test_read_series_fits_every_frame(self):
+        calc = PressureCalculator()
+        calc.engine.set_strategy(reading='Section series txt')
+        r1s = [c.r1.n for c in calc.read_series(self.write_section_series())]
+        self.assertEqual(len(r1s), 3)
+        for r1 in r1s:
+            self.assertAlmostEqual(r1, r1s[0], places=3)
+
+    def test_warm_started_series_matches_cold_fits(self):
+        path = self.write_section_series()
+        cold, warm = PressureCalculator(), PressureCalculator()
+        cold.engine.set_strategy(reading='Section series txt')
+        warm.engine.set_strategy(reading='Section series txt')
+        cold.engine.backfitter.warm_start = True
+        cold_r1s = []
+        for c in cold.read_series(path):
+            cold_r1s.append(c.r1.n)
+            c.engine.backfitter.reset()
+        warm_r1s = [c.r1.n for c in warm.read_series(path, warm_start=True)]
+        self.assertFalse(warm.engine.backfitter.warm_start)
+        for cold_r1, warm_r1 in zip(cold_r1s, warm_r1s):
+            self.assertAlmostEqual(cold_r1, warm_r1, places=5)
+
+    def test_warm_start_falls_back_after_drift(self):
+        calc = PressureCalculator()
+        backfitter = strategies.HuberBackfittingStrategy(warm_start=True)
+        calc.engine.backfitter = backfitter
+        calc.read(test_data1_path)
+        cold_args = calc.back_spectrum.curve.args
+        backfitter._previous = (calc.back_spectrum.domain, (1e6, -1e3))
+        calc.read(test_data1_path)
+        self.assertTrue(np.allclose(calc.back_spectrum.curve.args, cold_args))
+
+
+class TestBinaryReading(unittest.TestCase):
+    binary_format = strategies.BinaryFormat(
+        header_length=16, dtype='<u2', pixel_count=1024,
+        calibration=(680.0, 0.03), frame_header_length=8)
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = str(pathlib.Path(self.temp_dir.name).joinpath('data.bin'))
+        x = 680.0 + 0.03 * np.arange(1024)
+        self.r1s = [694.5, 695.0, 695.5]
+        with open(self.path, 'wb') as file:
+            file.write(bytes(16))
+            for r1 in self.r1s:
+                y = 100.0 + 1000.0 * np.exp(-(x - r1) ** 2 / 0.18) + \
+                    500.0 * np.exp(-(x - r1 + 1.4) ** 2 / 0.18)
+                file.write(bytes(8))
+                file.write(y.astype('<u2').tobytes())
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_frames_are_memory_mapped_views(self):
+        calc = PressureCalculator()
+        calc.dat_path = self.path
+        reader = strategies.BinaryReadingStrategy(self.binary_format)
+        frames = list(reader.frames(calc))
+        self.assertEqual(len(frames), 3)
+        for frame in frames:
+            self.assertFalse(frame.y.flags.owndata)
+            self.assertGreaterEqual(min(frame.x), 690.0)
+            self.assertLessEqual(max(frame.x), 705.0)
+
+    def test_format_is_required(self):
+        registry = strategies.ReadingStrategies.registry
+        self.assertNotIn('Binary spectrum', registry)
+        with self.assertRaises(TypeError):
+            strategies.BinaryReadingStrategy(None)
+
+    def test_read_series_of_binary_frames(self):
+        calc = PressureCalculator()
+        calc.engine.reader = strategies.BinaryReadingStrategy(
+            self.binary_format)
+        r1s = [c.r1.n for c in calc.read_series(self.path)]
+        for r1, expected_r1 in zip(r1s, self.r1s):
+            self.assertAlmostEqual(r1, expected_r1, places=1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,26 @@
+import copy
+import pathlib
+import tempfile
 import unittest
 from math import pi, sin
-from pruby.spectrum import Curve, Spectrum
-from pruby.utility import LineSubset
+import numpy as np
+from pruby.spectrum import Curve, Spectrum, SpectrumStack
+from pruby import strategies
+from pruby.utility import LineSubset, SpectrumCache
+
+
+temp_cache_dir = tempfile.TemporaryDirectory()
+default_cache = strategies.ReadingStrategies.cache
+
+
+def setUpModule():
+    strategies.ReadingStrategies.cache = \
+        SpectrumCache(directory=temp_cache_dir.name)
+
+
+def tearDownModule():
+    strategies.ReadingStrategies.cache = default_cache
+    temp_cache_dir.cleanup()
 
 
 class TestCurve(unittest.TestCase):
@@ -22,6 +41,18 @@ class TestCurve(unittest.TestCase):
         self.assertAlmostEqual(Curve(lambda x, a: a * x, (1.2,))(pi, 3.4),
                                10.6814150222)
 
+    def test_vectorized_call_evaluates_array_at_once(self):
+        calls = []
+        curve = Curve(lambda x, a: calls.append(x) or a * x, (2.0,),
+                      vectorized=True)
+        self.assertEqual(list(curve(np.array([1.0, 2.0, 3.0]))),
+                         [2.0, 4.0, 6.0])
+        self.assertEqual(len(calls), 1)
+
+    def test_scalar_only_call_evaluates_every_point(self):
+        curve = Curve(lambda x: x if x > 1.5 else 0.0)
+        self.assertEqual(list(curve(np.array([1.0, 2.0]))), [0.0, 2.0])
+
     def test_call_with_no_arguments(self):
         curve = Curve(lambda x, a: a * x, (1.2,))
         with self.assertRaises(IndexError):
@@ -58,6 +89,13 @@ class TestSpectrum(unittest.TestCase):
     def test_length(self):
         self.assertEqual(len(Spectrum(self.x, self.y)), 3)
 
+    def test_compact_representation(self):
+        spectrum = Spectrum(self.x, self.y, curve=Curve(lambda x: x),
+                            dtype=np.float32)
+        self.assertFalse(hasattr(spectrum, '__dict__'))
+        self.assertEqual(spectrum.y.dtype, np.float32)
+        self.assertEqual(spectrum.f.dtype, np.float64)
+
     def test_true_if_has_datapoints(self):
         self.assertTrue(Spectrum(self.x, self.y))
 
@@ -109,11 +147,175 @@ class TestSpectrum(unittest.TestCase):
         spectrum.focus_on_whole()
         self.assertAlmostEqual(sum(spectrum.focused.y), 10.2)
 
+    def test_derived_properties_are_cached(self):
+        calls = []
+        spectrum = Spectrum(self.x, self.y, sigma_type='huber',
+                            curve=Curve(lambda x: calls.append(x) or x))
+        _ = spectrum.f, spectrum.delta, spectrum.si, spectrum.mse
+        self.assertEqual(len(calls), 3)
+        self.assertIs(spectrum.focused, spectrum.focused)
+
+    def test_cache_invalidated_by_curve_args(self):
+        spectrum = Spectrum(self.x, self.y, curve=Curve(lambda x, a: a * x,
+                                                        (1.0,)))
+        self.assertAlmostEqual(sum(spectrum.f), 6.0)
+        spectrum.curve.args = (2.0,)
+        self.assertAlmostEqual(sum(spectrum.f), 12.0)
+        self.assertAlmostEqual(sum(spectrum.focused.f), 12.0)
+
+    def test_cache_survives_changes_of_assigned_args(self):
+        args = np.array([1.0])
+        spectrum = Spectrum(self.x, self.y, curve=Curve(lambda x, a: a * x,
+                                                        args))
+        self.assertAlmostEqual(sum(spectrum.f), 6.0)
+        args[0] = 2.0
+        self.assertIsInstance(spectrum.curve.args, tuple)
+        self.assertAlmostEqual(sum(spectrum.f), 6.0)
+        self.assertAlmostEqual(spectrum.curve(2.0), 2.0)
+
+    def test_cache_invalidated_by_data_and_focus(self):
+        spectrum = Spectrum(self.x, self.y, curve=Curve(lambda x: x))
+        self.assertAlmostEqual(sum(spectrum.delta), 4.2)
+        spectrum.y = [1.0, 2.0, 3.0]
+        self.assertAlmostEqual(sum(spectrum.delta), 0.0)
+        self.assertAlmostEqual(sum(spectrum.focused.y), 6.0)
+        spectrum.focus = LineSubset(0.5, 2.5)
+        self.assertAlmostEqual(sum(spectrum.focused.y), 3.0)
+
+    def test_deepcopy(self):
+        spectrum = Spectrum(self.x, self.y, focus=LineSubset(1.5, 3.0))
+        duplicate = copy.deepcopy(spectrum)
+        self.assertEqual(duplicate.focus, spectrum.focus)
+        self.assertTrue(np.array_equal(duplicate.y, spectrum.y))
+
+    def test_data_cache_invalidated_by_data_only(self):
+        spectrum = Spectrum(self.x, self.y, curve=Curve(lambda x: x))
+        calls = []
+
+        def compute():
+            calls.append(None)
+            return max(spectrum.y)
+        self.assertAlmostEqual(spectrum.cached_on_data('max', compute), 5.6)
+        spectrum.curve = Curve(lambda x: 2 * x)
+        spectrum.focus = LineSubset(0.5, 2.5)
+        self.assertAlmostEqual(spectrum.cached_on_data('max', compute), 5.6)
+        self.assertEqual(len(calls), 1)
+        spectrum.y = [1.0, 2.0, 3.0]
+        self.assertAlmostEqual(spectrum.cached_on_data('max', compute), 3.0)
+
+    def test_focused_is_view_for_contiguous_focus(self):
+        spectrum = Spectrum(self.x, self.y, focus=LineSubset(1.5, 3.5))
+        self.assertIsInstance(spectrum.focused.index, slice)
+        self.assertTrue(np.shares_memory(spectrum.focused.y, spectrum.y))
+        with self.assertRaises(ValueError):
+            spectrum.focused.y[0] = 0.0
+
+    def test_focused_uses_index_for_scattered_focus(self):
+        spectrum = Spectrum(self.x, self.y)
+        spectrum.focus_on_edge(width=0.5)
+        self.assertEqual(list(spectrum.focused.index), [0, 2])
+        self.assertAlmostEqual(sum(spectrum.focused.y), 6.8)
+
+    def test_input_is_copied_unless_requested(self):
+        y = np.array(self.y)
+        spectrum = Spectrum(self.x, y)
+        shared = Spectrum(self.x, y, copy=False)
+        y[0] = 0.0
+        self.assertAlmostEqual(spectrum.y[0], 1.2)
+        self.assertTrue(np.shares_memory(shared.y, y))
+        spectrum.y = y
+        y[1] = 0.0
+        self.assertAlmostEqual(spectrum.y[1], 3.4)
+
+    def test_copy_shares_data(self):
+        spectrum = Spectrum(self.x, self.y, curve=Curve(lambda x, a: a * x,
+                                                        (1.0,)))
+        spectrum_copy = spectrum.copy()
+        self.assertTrue(np.shares_memory(spectrum.y, spectrum_copy.y))
+        with self.assertRaises(ValueError):
+            spectrum_copy.y[0] = 0.0
+
+    def test_copy_survives_changes_of_original(self):
+        spectrum = Spectrum(self.x, self.y, curve=Curve(lambda x, a: a * x,
+                                                        (1.0,)))
+        spectrum_copy = spectrum.copy()
+        self.assertAlmostEqual(sum(spectrum_copy.f), 6.0)
+        with self.assertRaises(ValueError):
+            spectrum.y[0] = 0.0
+        spectrum.y = [0.0, 0.0, 0.0]
+        spectrum.x = [2.0, 4.0, 6.0]
+        self.assertAlmostEqual(sum(spectrum_copy.y), 10.2)
+        self.assertAlmostEqual(sum(spectrum_copy.f), 6.0)
+        self.assertAlmostEqual(sum(spectrum.f), 12.0)
+
+    def test_copy_is_independent(self):
+        spectrum = Spectrum(self.x, self.y, curve=Curve(lambda x, a: a * x,
+                                                        (1.0,)))
+        spectrum_copy = spectrum.copy(y=[0.0, 0.0, 0.0])
+        spectrum_copy.curve.args = (2.0,)
+        spectrum_copy.focus_on_edge(width=0.5)
+        self.assertAlmostEqual(sum(spectrum.y), 10.2)
+        self.assertAlmostEqual(sum(spectrum.f), 6.0)
+        self.assertEqual(spectrum.focus, LineSubset(1.0, 3.0))
+
     def test_focus_on_points(self):
         spectrum = Spectrum(self.x, self.y)
         spectrum.focus_on_points(points=(2.0,), width=1.5)
         self.assertAlmostEqual(sum(spectrum.focused.y), 3.4)
 
 
+class TestSpectrumStack(unittest.TestCase):
+    x = [1.0, 2.0, 3.0]
+    y = [[1.2, 3.4, 5.6], [2.0, 2.0, 2.0]]
+    test_directory = pathlib.Path(__file__).parent
+
+    def test_creation_of_empty(self):
+        self.assertFalse(SpectrumStack())
+
+    def test_creation_with_datapoints(self):
+        self.assertEqual(len(SpectrumStack(self.x, self.y)), 2)
+
+    def test_creation_with_incorrect_shape(self):
+        with self.assertRaises(ValueError):
+            SpectrumStack(self.x, [[1.0, 2.0]])
+
+    def test_from_spectra_exact(self):
+        spectra = [Spectrum(self.x, y) for y in self.y]
+        stack = SpectrumStack.from_spectra(spectra)
+        self.assertAlmostEqual(stack.y.sum(), 16.2)
+
+    def test_from_spectra_on_different_grids(self):
+        spectra = [Spectrum([1.0, 2.0, 3.0], [1.0, 2.0, 3.0]),
+                   Spectrum([1.5, 2.5, 3.5], [1.5, 2.5, 3.5])]
+        with self.assertRaises(ValueError):
+            SpectrumStack.from_spectra(spectra)
+        stack = SpectrumStack.from_spectra(spectra, resample='interpolate')
+        self.assertEqual(list(stack.x), [2.0, 3.0])
+        self.assertTrue(np.allclose(stack.y, [[2.0, 3.0], [2.0, 3.0]]))
+
+    def test_within(self):
+        stack = SpectrumStack(self.x, self.y)
+        stack_within = stack.within(LineSubset(1.5, 3.5))
+        self.assertTrue(np.shares_memory(stack.y, stack_within.y))
+        self.assertAlmostEqual(stack_within.y.sum(), 13.0)
+
+    def test_subtract_polynomial(self):
+        stack = SpectrumStack(self.x, self.y)
+        subtracted = stack.subtract_polynomial([[0.0, 1.0], [2.0, 0.0]])
+        self.assertTrue(np.allclose(subtracted.y, [[0.2, 1.4, 2.6],
+                                                   [0.0, 0.0, 0.0]]))
+
+    def test_fit_polynomial(self):
+        stack = SpectrumStack(self.x, self.y)
+        coefficients = stack.fit_polynomial(degree=1, sigma_type='equal')
+        self.assertTrue(np.allclose(coefficients, [[-1.0, 2.2], [2.0, 0.0]]))
+
+    def test_read_from_glob(self):
+        stack = SpectrumStack.read(str(self.test_directory.joinpath(
+            'test_data*.txt')), resample='interpolate', workers=2)
+        self.assertEqual(len(stack), 2)
+        self.assertEqual(stack.y.shape[1], len(stack.x))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,7 +1,24 @@
+import copy
+import os
+import pickle
+import pathlib
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 from math import pi, inf
-from pruby.utility import cycle, LineSubset
+import numpy as np
+from scipy.optimize import curve_fit
+from pruby.utility import cycle, LineSubset, SpectrumCache
+from uncertainties import ufloat
 from pruby.utility import polynomial, gaussian, lorentzian, pseudovoigt
+from pruby.utility import Polynomial
+from pruby.utility import kernels
+from pruby.utility.fitting import irls_polynomial_fit, \
+    weighted_polynomial_fit, arpls_baseline, parameter_transform, \
+    scaled_curve_fit, batched_curve_fit, huber_sigma, chord_coefficients
+from pruby.utility import PolynomialModel, GaussianModel, LorentzianModel, \
+    PseudovoigtModel, CamelModel
 
 
 class TestCycle(unittest.TestCase):
@@ -57,6 +74,284 @@ class TestFunctions(unittest.TestCase):
         self.assertAlmostEqual(pseudovoigt(12, -34, 56, 78)(pi), -58.3996662756)
 
 
+class TestPolynomial(unittest.TestCase):
+    p = Polynomial(12., -34., 56.)
+
+    def test_array_value(self):
+        x = np.linspace(-2., 2., 5)
+        np.testing.assert_allclose(self.p(x), 12. - 34. * x + 56. * x ** 2)
+
+    def test_constant_array_value(self):
+        np.testing.assert_array_equal(Polynomial(5.)(np.zeros(3)), [5.] * 3)
+
+    def test_derivative(self):
+        self.assertEqual(self.p.derivative.coefficients, (-34., 112.))
+        self.assertIs(self.p.derivative, self.p.derivative)
+
+    def test_ufloat_value(self):
+        x = ufloat(pi, 0.01)
+        expected = 12. - 34. * x + 56. * x ** 2
+        self.assertAlmostEqual(self.p(x).n, expected.n)
+        self.assertAlmostEqual(self.p(x).s, expected.s)
+
+    def test_ufloat_keeps_correlations(self):
+        x = ufloat(pi, 0.01)
+        self.assertAlmostEqual((self.p(x) - self.p(x)).s, 0.0)
+        self.assertAlmostEqual((self.p(x) - 56. * x ** 2).s,
+                               (12. - 34. * x).s)
+
+    def test_ufloat_coefficients(self):
+        a = ufloat(2.0, 0.1)
+        p = Polynomial(0.0, a)
+        self.assertAlmostEqual(p(3.0).s, 0.3)
+        self.assertAlmostEqual((p(3.0) - 3 * a).s, 0.0)
+
+
+class TestJacobians(unittest.TestCase):
+    x = np.linspace(690., 700., 101)
+
+    def assert_jacobian_matches(self, function, model, args):
+        expected = np.empty((len(self.x), len(args)))
+        for i in range(len(args)):
+            step = 1e-6 * max(abs(args[i]), 1.0)
+            up, down = list(args), list(args)
+            up[i] += step
+            down[i] -= step
+            expected[:, i] = (function(*up)(self.x) -
+                              function(*down)(self.x)) / (2 * step)
+        np.testing.assert_allclose(model.jacobian(self.x, *args), expected,
+                                   rtol=1e-5, atol=1e-6)
+
+    def test_polynomial_jacobian(self):
+        self.assert_jacobian_matches(polynomial, PolynomialModel(degree=2),
+                                     (2.0, -0.5, 0.01))
+
+    def test_gaussian_jacobian(self):
+        self.assert_jacobian_matches(gaussian, GaussianModel(),
+                                     (10.0, 694.2, 0.3))
+
+    def test_lorentzian_jacobian(self):
+        self.assert_jacobian_matches(lorentzian, LorentzianModel(),
+                                     (10.0, 694.2, 0.3))
+
+    def test_pseudovoigt_jacobian(self):
+        self.assert_jacobian_matches(pseudovoigt, PseudovoigtModel(),
+                                     (10.0, 694.2, 0.6, 0.4))
+
+
+class TestModels(unittest.TestCase):
+    x = np.linspace(690., 700., 101)
+    cases = [(PolynomialModel(degree=2), polynomial, (2.0, -0.5, 0.01)),
+             (GaussianModel(), gaussian, (10.0, 694.2, 0.3)),
+             (LorentzianModel(), lorentzian, (10.0, 694.2, 0.3)),
+             (PseudovoigtModel(), pseudovoigt, (10.0, 694.2, 0.6, 0.4))]
+
+    def test_values_match_functions(self):
+        for model, function, args in self.cases:
+            np.testing.assert_allclose(model(self.x, *args),
+                                       function(*args)(self.x), rtol=1e-12)
+
+    def test_scalar_value(self):
+        self.assertAlmostEqual(GaussianModel()(1.0, 2.0, 1.0, 1.0), 2.0)
+
+    def test_buffers_are_reused(self):
+        model = GaussianModel()
+        first = model(self.x, 10.0, 694.2, 0.3)
+        second = model(self.x, 5.0, 694.2, 0.3)
+        self.assertIs(first, second)
+        self.assertIsNot(first, model(self.x[:10], 5.0, 694.2, 0.3))
+
+    def test_buffers_do_not_accumulate(self):
+        model = GaussianModel() + GaussianModel()
+        for length in range(10, 50):
+            model(self.x[:length], 10.0, 694.2, 0.3, 5.0, 692.8, 0.3)
+            model.jacobian(self.x[:length], 10.0, 694.2, 0.3, 5.0, 692.8, 0.3)
+        names = len(model._buffers)
+        model(self.x, 10.0, 694.2, 0.3, 5.0, 692.8, 0.3)
+        self.assertEqual(len(model._buffers), names)
+        self.assertLessEqual(names, 3)
+
+    def test_sum_model(self):
+        model = GaussianModel() + PseudovoigtModel()
+        args = (10.0, 694.2, 0.3, 5.0, 692.8, 0.6, 0.4)
+        expected = gaussian(*args[:3])(self.x) + pseudovoigt(*args[3:])(self.x)
+        np.testing.assert_allclose(model(self.x, *args), expected, rtol=1e-12)
+        self.assertEqual(model.names, ('a1', 'mu1', 'si1', 'a2', 'mu2', 'w2',
+                                       'et2'))
+        self.assertEqual(model.kinds[3:], ('amplitude', 'position', 'width',
+                                           'shape'))
+
+    def test_camel_model(self):
+        args = (10.0, 694.2, 0.35, 5.0, 692.8, 0.35, 1.0, 1.0)
+        camel = CamelModel()
+        expected = gaussian(*args[:3])(self.x) + gaussian(*args[3:6])(self.x) \
+            + gaussian(args[6], (args[1] + args[4]) / 2, args[7])(self.x)
+        np.testing.assert_allclose(camel(self.x, *args), expected, rtol=1e-12)
+        jacobian = camel.jacobian(self.x, *args).copy()
+        for i in range(len(args)):
+            up, down = list(args), list(args)
+            up[i] += 1e-6
+            down[i] -= 1e-6
+            difference = (camel(self.x, *up).copy() -
+                          camel(self.x, *down)) / 2e-6
+            np.testing.assert_allclose(jacobian[:, i], difference, atol=1e-4)
+
+
+class TestKernels(unittest.TestCase):
+    x = np.linspace(690., 700., 101)
+    y = gaussian(10.0, 694.2, 0.3)(x) + gaussian(5.0, 692.8, 0.3)(x) + 0.1
+    gaussians = (10.0, 694.3, 0.35, 5.0, 692.7, 0.25)
+    pseudovoigts = (10.0, 694.3, 0.7, 0.4, 5.0, 692.7, 0.5, 0.6)
+
+    def setUp(self):
+        self.default_backend = kernels.backend
+
+    def tearDown(self):
+        kernels.backend = self.default_backend
+
+    def assert_backends_agree(self, backend):
+        pairs = [(GaussianModel() + GaussianModel(), self.gaussians,
+                  backend.two_gaussians),
+                 (PseudovoigtModel() + PseudovoigtModel(), self.pseudovoigts,
+                  backend.two_pseudovoigts)]
+        kernels.backend = kernels.NUMPY_BACKEND
+        for model, args, kernel in pairs:
+            out = np.empty_like(self.x)
+            kernel(self.x, self.x, np.array(args), out, False)
+            np.testing.assert_allclose(out, model(self.x, *args), rtol=1e-14)
+            kernel(self.x, self.y, np.array(args), out, True)
+            np.testing.assert_allclose(out, model.residual(
+                self.x, self.y, *args), rtol=1e-12, atol=1e-14)
+        delta = self.y - 5.0
+        np.testing.assert_array_equal(
+            backend.huber_sigma(delta, np.empty_like(delta)),
+            kernels.huber_sigma_numpy(delta, np.empty_like(delta)))
+
+    def test_loops_agree_with_numpy(self):
+        loops = kernels.KernelBackend(
+            'loops', huber_sigma=kernels.huber_sigma_loop,
+            two_gaussians=kernels.two_gaussians_loop,
+            two_pseudovoigts=kernels.two_pseudovoigts_loop)
+        self.assert_backends_agree(loops)
+
+    @unittest.skipIf(kernels.numba is None, 'numba is not installed')
+    def test_numba_agrees_with_numpy(self):
+        self.assert_backends_agree(kernels.set_backend('numba'))
+
+    def test_huber_sigma_matches_definition(self):
+        delta = self.y - 5.0
+        tol = 0.01 * max(abs(delta))
+        expected = np.where(delta < tol, tol ** 2, tol * (2 * delta - tol))
+        np.testing.assert_array_equal(
+            kernels.huber_sigma_numpy(delta, np.empty_like(delta)), expected)
+
+    def test_huber_sigma_is_evaluated_per_row(self):
+        delta = np.stack([self.y - 5.0, 2 * self.y])
+        expected = [kernels.huber_sigma_numpy(row, np.empty_like(row))
+                    for row in delta]
+        np.testing.assert_array_equal(huber_sigma(delta), expected)
+        np.testing.assert_array_equal(huber_sigma(delta[0]), expected[0])
+
+    def test_unknown_backend(self):
+        self.assertRaises(KeyError, kernels.set_backend, 'fortran')
+
+
+class TestFitting(unittest.TestCase):
+    x = np.linspace(690., 705., 301)
+    line = polynomial(-3000.0, 5.0)(x)
+    peaks = gaussian(1000.0, 694.2, 0.3)(x) + gaussian(500.0, 692.8, 0.3)(x)
+
+    def test_weighted_fit_is_exact(self):
+        y = polynomial(1.0, -2.0, 0.5, 0.01)(self.x - 697.0)
+        weights = np.linspace(0.5, 2.0, len(self.x))
+        coefficients = weighted_polynomial_fit(self.x, y, weights, degree=3)
+        np.testing.assert_allclose(polynomial(*coefficients)(self.x), y,
+                                   atol=1e-6)
+
+    def test_chord_coefficients(self):
+        np.testing.assert_allclose(chord_coefficients(
+            self.x, self.line, degree=2), (-3000.0, 5.0, 0.0))
+        batch = chord_coefficients(self.x, [self.line, 2 * self.line])
+        np.testing.assert_allclose(batch, [(-3000.0, 5.0), (-6000.0, 10.0)])
+
+    def test_huber_ignores_peaks(self):
+        coefficients = irls_polynomial_fit(self.x, self.line + self.peaks)
+        np.testing.assert_allclose(polynomial(*coefficients)(self.x),
+                                   self.line, atol=1.0)
+
+    def test_mask(self):
+        mask = (self.x < 691) | (self.x > 704)
+        coefficients = irls_polynomial_fit(self.x, self.line + self.peaks,
+                                           sigma_type='equal', mask=mask)
+        np.testing.assert_allclose(coefficients, (-3000.0, 5.0), rtol=1e-6)
+
+    def test_arpls_follows_curved_baseline(self):
+        curved = 50.0 * np.sin((self.x - 690.) / 5.)
+        baseline = arpls_baseline(curved + self.peaks, smoothness=1e5)
+        np.testing.assert_allclose(baseline, curved, atol=5.0)
+        batch = arpls_baseline(np.vstack([curved, curved + self.peaks]))
+        self.assertEqual(batch.shape, (2, len(self.x)))
+
+    def test_warm_start_takes_fewer_cycles(self):
+        edge = gaussian(200.0, 704.8, 0.5)(self.x)
+        y1 = self.line + self.peaks + edge
+        y2 = self.line * 1.01 + gaussian(1000.0, 694.3, 0.3)(self.x) \
+            + gaussian(500.0, 692.9, 0.3)(self.x) + edge
+        previous = irls_polynomial_fit(self.x, y1, shift_tolerance=1e-6)
+        cold, cold_cycles = irls_polynomial_fit(
+            self.x, y2, shift_tolerance=1e-6, full_output=True)
+        warm, warm_cycles = irls_polynomial_fit(
+            self.x, y2, coefficients=previous, shift_tolerance=1e-6,
+            full_output=True)
+        self.assertLess(warm_cycles, cold_cycles)
+        np.testing.assert_allclose(polynomial(*warm)(self.x),
+                                   polynomial(*cold)(self.x), atol=1e-2)
+
+    def test_batch_matches_single(self):
+        y = np.vstack([self.line + self.peaks * i for i in range(1, 4)])
+        batch = irls_polynomial_fit(self.x, y, degree=2)
+        for row, coefficients in zip(y, batch):
+            np.testing.assert_allclose(
+                irls_polynomial_fit(self.x, row, degree=2), coefficients)
+
+    def test_parameter_transform_of_polynomial(self):
+        model = PolynomialModel(2)
+        offset, matrix = parameter_transform(model.parameters, 697., 7.5, 10.)
+        scaled = np.array([1.0, -2.0, 0.5])
+        u = (self.x - 697.) / 7.5
+        np.testing.assert_allclose(
+            model(self.x, *(offset + matrix @ scaled)),
+            10. * polynomial(*scaled)(u), atol=1e-8)
+
+    def test_scaled_fit_matches_plain_fit(self):
+        model = GaussianModel() + GaussianModel()
+        noise = np.random.default_rng(1).normal(0., 5., len(self.x))
+        p0 = (900., 694.0, 0.4, 600., 692.6, 0.4)
+        popt, pcov = scaled_curve_fit(model, self.x, self.peaks + noise, p0)
+        plain_popt, plain_pcov = curve_fit(model, self.x, self.peaks + noise,
+                                           p0=p0, jac=model.jacobian)
+        np.testing.assert_allclose(popt, plain_popt, rtol=1e-6)
+        np.testing.assert_allclose(pcov, plain_pcov, rtol=1e-3)
+
+    def test_batched_fit_matches_single_fits(self):
+        model = PseudovoigtModel() + PseudovoigtModel()
+        rng = np.random.default_rng(2)
+        shifts = rng.uniform(-0.3, 0.3, 5)
+        y = np.vstack([model(self.x, 1000., 694.2 + s, 0.6, 0.7,
+                             500., 692.8 + s, 0.6, 0.7).copy()
+                       + rng.normal(0., 5., len(self.x)) for s in shifts])
+        p0 = np.tile((900., 694.2, 0.5, 0.5, 600., 692.8, 0.5, 0.5), (5, 1))
+        mask = np.abs(self.x - 693.5) < 2.0
+        popt, pcov, _, converged = batched_curve_fit(
+            model, self.x, y, p0, mask=mask, full_output=True)
+        self.assertTrue(np.all(converged))
+        for row, row_popt, row_pcov in zip(y, popt, pcov):
+            single_popt, single_pcov = scaled_curve_fit(
+                model, self.x[mask], row[mask], p0[0])
+            np.testing.assert_allclose(row_popt, single_popt, rtol=1e-6)
+            np.testing.assert_allclose(row_pcov, single_pcov, rtol=1e-3)
+
+
 class TestLineSubset(unittest.TestCase):
     def test_create_from_pair(self):
         self.assertTrue(LineSubset(1.2, inf))
@@ -124,6 +419,114 @@ class TestLineSubset(unittest.TestCase):
     def test_contains_other(self):
         self.assertIn(LineSubset(1.1, 3.3), LineSubset(1.1, inf))
 
+    def test_mask_equals_contains(self):
+        subset = LineSubset([(-inf, -2), (-1, 1), (1.5, 1.5), (2, 3)])
+        values = np.linspace(-4, 4, 161)
+        expected = [v in subset for v in values]
+        self.assertEqual(list(subset.mask(values)), expected)
+
+    def test_mask_of_empty(self):
+        self.assertFalse(any(LineSubset().mask([0.0, 1.0])))
+
+    def test_point_vanishes_in_intersection(self):
+        self.assertEqual(LineSubset([(1, 1), (2, 3)]) * LineSubset(0, 5),
+                         LineSubset(2, 3))
+
+    def test_touching_intersection_is_empty(self):
+        self.assertEqual(LineSubset(0, 1) * LineSubset(1, 2), LineSubset())
+
+    def test_hashable(self):
+        cache = {LineSubset([(0, 1), (2, 3)]): 'value'}
+        self.assertEqual(cache[LineSubset([(2, 3), (0, 1.0)])], 'value')
+
+    def test_immutable(self):
+        subset = LineSubset(1.1, 2.2)
+        with self.assertRaises(AttributeError):
+            subset.segments = []
+        with self.assertRaises(ValueError):
+            subset.bounds[0, 0] = 0.0
+
+    def test_copy_and_pickle(self):
+        for subset in (LineSubset(), LineSubset([(0, 1), (2, inf)])):
+            for duplicate in (copy.copy(subset), copy.deepcopy(subset),
+                              pickle.loads(pickle.dumps(subset))):
+                self.assertEqual(duplicate, subset)
+                self.assertEqual(hash(duplicate), hash(subset))
+                self.assertFalse(duplicate.bounds.flags.writeable)
+
+
+class TestSpectrumCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = SpectrumCache(directory=self.temp_dir.name)
+        self.path = pathlib.Path(self.temp_dir.name).joinpath('data.txt')
+        self.path.write_text('1.0 2.0')
+        self.x, self.y = np.array([1.0, 2.0]), np.array([3.0, 4.0])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_miss_before_store(self):
+        self.assertIsNone(self.cache.load(self.path, 'reader'))
+
+    def test_store_and_load(self):
+        self.cache.store(self.path, 'reader', self.x, self.y)
+        x, y = self.cache.load(self.path, 'reader')
+        self.assertIsInstance(x, np.memmap)
+        self.assertTrue(np.array_equal(x, self.x))
+        self.assertTrue(np.array_equal(y, self.y))
+
+    def test_key_depends_on_reader_and_mtime(self):
+        self.cache.store(self.path, 'reader', self.x, self.y)
+        self.assertIsNone(self.cache.load(self.path, 'other reader'))
+        os.utime(self.path, ns=(0, 0))
+        self.assertIsNone(self.cache.load(self.path, 'reader'))
+
+    def test_disabled(self):
+        self.cache.enabled = False
+        self.cache.store(self.path, 'reader', self.x, self.y)
+        self.cache.enabled = True
+        self.assertIsNone(self.cache.load(self.path, 'reader'))
+
+    def test_eviction_of_least_recently_used(self):
+        other_path = self.path.with_name('other.txt')
+        other_path.write_text('3.0 4.0')
+        self.cache.store(self.path, 'reader', self.x, self.y)
+        entry_size = sum(e.stat().st_size for e in
+                         pathlib.Path(self.temp_dir.name).glob('*.npy'))
+        self.cache.max_size = entry_size
+        self.cache.store(other_path, 'reader', self.x, self.y)
+        self.assertIsNone(self.cache.load(self.path, 'reader'))
+        self.assertIsNotNone(self.cache.load(other_path, 'reader'))
+
+    def test_directory_is_scanned_only_when_full(self):
+        self.cache.store(self.path, 'reader', self.x, self.y)
+        with mock.patch.object(self.cache, '_entries') as entries:
+            for i in range(5):
+                path = self.path.with_name(f'data{i}.txt')
+                path.write_text('1.0 2.0')
+                self.cache.store(path, 'reader', self.x, self.y)
+            entries.assert_not_called()
+            self.cache.max_size = 0
+            self.cache.store(self.path, 'other reader', self.x, self.y)
+            entries.assert_called_once()
+
+    def test_concurrent_stores_keep_size(self):
+        paths = [self.path.with_name(f'data{i}.txt') for i in range(32)]
+        for path in paths:
+            path.write_text('1.0 2.0')
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda path: self.cache.store(
+                path, 'reader', self.x, self.y), paths))
+        self.assertEqual(self.cache._size, sum(
+            size for _, size, _ in self.cache._entries()))
+
+    def test_default_directory_is_per_user(self):
+        directory = SpectrumCache().directory
+        self.assertNotEqual(directory.parent,
+                            pathlib.Path(tempfile.gettempdir()))
+        self.assertEqual(directory.name, 'pruby')
+
 
 if __name__ == '__main__':
     unittest.main()